@@ -0,0 +1,167 @@
+""" Vectorized flattening of LDraw reference trees using NumPy.
+
+This produces the same flattened geometry as geometry.Flattener, but
+keeps every flattened part as contiguous arrays and places all
+instances of a subpart referenced by a (sub)file in one batched matrix
+multiplication. NumPy is optional, numpy is None if it is missing.
+"""
+
+import collections
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .geometry import MAIN, Flattener, walk, primitive
+
+
+# Flattened geometry of a part as arrays over its K elements:
+#     points: (K, 4, 3) coordinates, padded with zeros beyond counts
+#     counts: (K,) number of points of each element
+#     faces:  (K,) True for faces, False for lines
+#     colors: (K,) LDraw color codes
+#     steps:  (K,) STEP each element got added in
+Geometry = collections.namedtuple(
+    'Geometry', ['points', 'counts', 'faces', 'colors', 'steps'])
+
+# for each number of points the order of a reversed element
+REVERSE = [[0, 1, 2, 3], [0, 1, 2, 3], [1, 0, 2, 3], [2, 1, 0, 3],
+           [3, 2, 1, 0]]
+
+
+def make_geometry(elements):
+    """ build arrays from a list of (face, points, color, step) """
+    points = numpy.zeros((len(elements), 4, 3))
+    for row, (_, pts, _, _) in enumerate(elements):
+        points[row, :len(pts)] = pts
+    return Geometry(
+        points,
+        numpy.array([len(pts) for _, pts, _, _ in elements], dtype=int),
+        numpy.array([face for face, _, _, _ in elements], dtype=bool),
+        numpy.array([color for _, _, color, _ in elements], dtype=int),
+        numpy.array([step for _, _, _, step in elements], dtype=int))
+
+
+def concatenate(chunks):
+    """ join several geometries in order """
+    if not chunks:
+        return make_geometry([])
+    return Geometry(*(numpy.concatenate(arrays) for arrays in zip(*chunks)))
+
+
+def det3(rot):
+    """ calculate determinants of a stack of 3x3 matrices
+
+    This uses the same expansion as det3() in lib.scad, so singular
+    matrices give exactly 0 instead of a rounding residue.
+    """
+    return (rot[:, 0, 0] * rot[:, 1, 1] * rot[:, 2, 2] +
+            rot[:, 0, 1] * rot[:, 1, 2] * rot[:, 2, 0] +
+            rot[:, 0, 2] * rot[:, 1, 0] * rot[:, 2, 1] -
+            rot[:, 0, 2] * rot[:, 1, 1] * rot[:, 2, 0] -
+            rot[:, 0, 1] * rot[:, 1, 0] * rot[:, 2, 2] -
+            rot[:, 0, 0] * rot[:, 1, 2] * rot[:, 2, 1])
+
+
+def place(geometry, matrices, cols, inverts, steps):
+    """ place R instances of a subpart at once
+
+    matrices is an (R, 3, 4) array of type 1 matrices, cols, inverts
+    and steps (R,) arrays of the remaining type 1 line state. Returns
+    the geometries of all instances with shape (R, K, ...).
+    """
+    rot = matrices[:, :, :3]
+    points = numpy.einsum('rij,kpj->rkpi', rot, geometry.points) + \
+        matrices[:, None, None, :, 3]
+    flip = (det3(rot) < 0) != inverts
+    reverse = flip[:, None] & geometry.faces[None, :]
+    if reverse.any():
+        order = numpy.array(REVERSE)[geometry.counts]
+        reversed_points = numpy.take_along_axis(
+            points, order[None, :, :, None], axis=2)
+        points = numpy.where(reverse[:, :, None, None], reversed_points,
+                             points)
+    complement = numpy.where(cols == 16, 24,
+                             numpy.where(cols == 24, 16, -cols - 1))
+    colors = numpy.where(
+        geometry.colors[None, :] == 16, cols[:, None],
+        numpy.where(geometry.colors[None, :] == 24, complement[:, None],
+                    geometry.colors[None, :]))
+    count = len(matrices)
+    return Geometry(
+        points,
+        numpy.broadcast_to(geometry.counts, (count,) + geometry.counts.shape),
+        numpy.broadcast_to(geometry.faces, (count,) + geometry.faces.shape),
+        colors,
+        numpy.broadcast_to(steps[:, None], colors.shape))
+
+
+def to_elements(geometry):
+    """ convert arrays back into a list of (face, points, color, step) """
+    return [(face, tuple(tuple(point) for point in points[:count]),
+             color, step)
+            for points, count, face, color, step in zip(
+                geometry.points.tolist(), geometry.counts.tolist(),
+                geometry.faces.tolist(), geometry.colors.tolist(),
+                geometry.steps.tolist())]
+
+
+class ArrayFlattener(Flattener):
+    """ Flatten LDraw reference trees into arrays
+
+    Same interface as geometry.Flattener, with flattened library parts
+    kept as Geometry arrays in self.parts.
+    """
+
+    @staticmethod
+    def place_instances(chunks, instances):
+        """ fill in the placeholders of type 1 lines in chunks
+
+        instances maps each referenced subpart to its geometry and the
+        list of its (position, matrix, color, invert, step) references.
+        """
+        for geometry, refs in instances.values():
+            positions, matrices, cols, inverts, steps = zip(*refs)
+            placed = place(geometry, numpy.array(matrices),
+                           numpy.array(cols), numpy.array(inverts),
+                           numpy.array(steps))
+            for row, position in enumerate(positions):
+                chunks[position] = Geometry(
+                    *(array[row] for array in placed))
+
+    def lines(self, commands, sections, stack=()):
+        """ flatten a list of commands as lines() in lib.scad """
+        chunks = []
+        elements = []
+        instances = {}
+        for command, step, ccw, invert in walk(commands):
+            if command[0] == 1:
+                if elements:
+                    chunks.append(make_geometry(elements))
+                    elements = []
+                key = self.key(command[3])
+                if key not in instances:
+                    instances[key] = (
+                        self.resolve(command[3], sections, stack), [])
+                instances[key][1].append(
+                    (len(chunks), command[2], command[1], invert, step))
+                chunks.append(None)
+            else:
+                elements.append(primitive(command, step, ccw))
+        if elements:
+            chunks.append(make_geometry(elements))
+        self.place_instances(chunks, instances)
+        return concatenate(chunks)
+
+    def flatten_arrays(self, sections):
+        """ flatten the main section of a parsed file into arrays """
+        return self.lines(sections[MAIN], sections, (MAIN,))
+
+    def flatten(self, sections):
+        """ flatten the main section of a parsed file """
+        return to_elements(self.flatten_arrays(sections))
+
+    def flatten_part(self, name):
+        """ flatten a library file """
+        return to_elements(super().flatten_part(name))
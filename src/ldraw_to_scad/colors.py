@@ -0,0 +1,112 @@
+""" Translation of the LDraw color tables.
+
+Colors are emitted as lookup tables rather than as a chain of
+conditions: codes below DENSE_CODES index a vector directly, all other
+codes are found by search() in a table of [code, color] pairs.
+"""
+
+
+# codes below this are looked up in a dense vector
+DENSE_CODES = 512
+
+# colors given directly as 0x2RRGGBB, with the complement as edge color
+DIRECT_COLOR = ('(id>=2*16^6) ? [chr(35, [for (i=[5:-1:0])'
+                'let(n=floor(id/16^i)%16) n+(n<10?48:55)]),'
+                'chr(35, [for (i=[5:-1:0])'
+                'let(n=15-floor(id/16^i)%16) n+(n<10?48:55)])] :'
+                '"UNKNOWN"')
+
+
+def parse_colour(params):
+    """ get the options of a !COLOUR meta command """
+    data = {}
+    if len(params) == 2:
+        print('!COLOUR line with no data!')
+    data['name'] = params[2]
+    skip = False
+    for pos, opt in enumerate(params[3:]):
+        if skip:
+            skip = False
+            continue
+        if opt in ['CODE', 'VALUE', 'ALPHA', 'LUMINANCE', 'EDGE']:
+            data[opt] = params[pos+4]
+            skip = True
+        elif opt in ['METAL', 'RUBBER', 'PEARLESCENT', 'CHROME',
+                     'MATTE_METALLIC']:
+            data[opt] = True
+        elif opt == 'MATERIAL':
+            data[opt] = params[pos+1:]
+            break
+        else:
+            print(f'Unknown !COLOUR option {opt}!')
+    return data
+
+
+def read_colors(filedata):
+    """ read a color table into a dictionary of code to color
+
+    The color of each code is an OpenSCAD [value, edge] pair. Only the
+    first definition of a code counts.
+    """
+    colors = {}
+    for line in filedata:
+        params = line.split()
+        if len(params) >= 2 and params[0] == '0' and params[1] == '!COLOUR':
+            data = parse_colour(params)
+            alpha = int(data["ALPHA"]) if "ALPHA" in data else 255
+            colors.setdefault(
+                int(data["CODE"]),
+                f'["{data["VALUE"]}{alpha:02X}","{data["EDGE"]}"]')
+    return colors
+
+
+def lookup_codes(codes):
+    """ get the table entries needed for the color codes of lines
+
+    Negative codes stand for the complementary color of code -n-1,
+    16 and 24 get inherited and are not looked up.
+    """
+    result = set()
+    for code in codes:
+        try:
+            code = int(code)
+        except ValueError:
+            continue
+        if code < 0:
+            code = -code - 1
+        if code not in (16, 24):
+            result.add(code)
+    return result
+
+
+def scad_vector(items):
+    """ format a vector with an item per line """
+    return '[\n ' + ',\n '.join(items) + ']' if items else '[]'
+
+
+def color_table(colfile, colors, codes=None):
+    """ translate a color table into an ldraw_color_<colfile> function
+
+    With codes given only the colors of those codes are included.
+    """
+    if codes is not None:
+        codes = lookup_codes(codes)
+        colors = {code: color for code, color in colors.items()
+                  if code in codes}
+    table = f'ldraw_colors_{colfile}'
+    dense = [code for code in colors if 0 <= code < DENSE_CODES]
+    vector = ['undef'] * (max(dense) + 1 if dense else 0)
+    for code in dense:
+        vector[code] = colors[code]
+    sparse = [f'[{code}, {color}]' for code, color in sorted(colors.items())
+              if not 0 <= code < DENSE_CODES]
+    return '\n'.join([
+        f'{table} = {scad_vector(vector)};',
+        f'{table}_sparse = {scad_vector(sparse)};',
+        f'function ldraw_color_{colfile}(id) =',
+        f'    let(dense=(id >= 0 && id < len({table})) ?',
+        f'            {table}[id] : undef,',
+        f'        sparse=is_undef(dense) ? search(id, {table}_sparse) : [])',
+        '    !is_undef(dense) ? dense :',
+        f'    sparse != [] ? {table}_sparse[sparse[0]][1] :',
+        '    ' + DIRECT_COLOR + ';']) + '\n'
@@ -0,0 +1,146 @@
+""" Dependency graph of LDraw files. """
+
+import json
+import heapq
+
+
+class DependencyGraph:
+    """ Graph of the references between LDraw files
+
+    edges maps the name of each file to the names of the files it
+    references, as collected by LDrawConverter.add_dep(). Names are
+    compared in lower case like the dependencies of the converter.
+    References to files that are not part of the graph are missing.
+    """
+
+    def __init__(self, edges):
+        self.edges = {name.lower(): sorted({dep.lower() for dep in deps})
+                      for name, deps in edges.items()}
+        self.reverse = {name: [] for name in self.edges}
+        for name, deps in sorted(self.edges.items()):
+            for dep in deps:
+                if dep in self.reverse:
+                    self.reverse[dep].append(name)
+
+    def __contains__(self, name):
+        return name.lower() in self.edges
+
+    def __len__(self):
+        return len(self.edges)
+
+    def missing(self):
+        """ get the missing files with the files referencing them """
+        result = {}
+        for name, deps in sorted(self.edges.items()):
+            for dep in deps:
+                if dep not in self.edges:
+                    result.setdefault(dep, []).append(name)
+        return result
+
+    @staticmethod
+    def closure(start, edges):
+        """ get all names reachable from start """
+        result = set()
+        stack = list(edges.get(start, ()))
+        while stack:
+            name = stack.pop()
+            if name not in result:
+                result.add(name)
+                stack.extend(edges.get(name, ()))
+        return sorted(result)
+
+    def dependencies(self, name, transitive=False):
+        """ get the files referenced by a file """
+        name = name.lower()
+        if transitive:
+            return self.closure(name, self.edges)
+        return list(self.edges.get(name, ()))
+
+    def dependents(self, name, transitive=False):
+        """ get the files referencing a file
+
+        With transitive set this lists every file that is affected by a
+        change of the file.
+        """
+        name = name.lower()
+        if transitive:
+            return self.closure(name, self.reverse)
+        return list(self.reverse.get(name, ()))
+
+    def cycles(self):
+        """ get the groups of files referencing each other in a circle
+
+        Uses Tarjan's algorithm for strongly connected components without
+        recursion, returning every component of more than one file and
+        every file referencing itself.
+        """
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        result = []
+        for root in sorted(self.edges):
+            if root in index:
+                continue
+            work = [(root, iter(self.edges[root]))]
+            index[root] = lowlink[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            while work:
+                name, deps = work[-1]
+                for dep in deps:
+                    if dep not in self.edges:
+                        continue
+                    if dep not in index:
+                        index[dep] = lowlink[dep] = len(index)
+                        stack.append(dep)
+                        on_stack.add(dep)
+                        work.append((dep, iter(self.edges[dep])))
+                        break
+                    if dep in on_stack:
+                        lowlink[name] = min(lowlink[name], index[dep])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[name])
+                    if lowlink[name] == index[name]:
+                        component = []
+                        while not component or component[-1] != name:
+                            component.append(stack.pop())
+                            on_stack.discard(component[-1])
+                        if len(component) > 1 or name in self.edges[name]:
+                            result.append(sorted(component))
+        return sorted(result)
+
+    def order(self):
+        """ get all files with every file following its dependencies
+
+        Files that do not depend on each other are ordered by name.
+        Raises ValueError if there are circular references.
+        """
+        pending = {name: len([dep for dep in deps if dep in self.edges])
+                   for name, deps in self.edges.items()}
+        ready = [name for name, count in pending.items() if count == 0]
+        heapq.heapify(ready)
+        result = []
+        while ready:
+            name = heapq.heappop(ready)
+            result.append(name)
+            for dependent in self.reverse[name]:
+                pending[dependent] -= 1
+                if pending[dependent] == 0:
+                    heapq.heappush(ready, dependent)
+        if len(result) != len(self.edges):
+            raise ValueError(f'circular references: {self.cycles()}')
+        return result
+
+    def to_dict(self):
+        """ get the graph as JSON compatible data """
+        return {'files': self.edges, 'missing': self.missing(),
+                'cycles': self.cycles()}
+
+    def save(self, filename):
+        """ write the graph as JSON """
+        with open(filename, 'w', encoding="utf-8") as fdw:
+            json.dump(self.to_dict(), fdw, indent=1, sort_keys=True)
@@ -0,0 +1,253 @@
+""" Output of flattened geometry for the LDraw converter. """
+
+import os
+
+from . import geometry
+from . import arraygeometry
+from . import mesh
+from . import meshexport
+
+
+# formats of meshes exported without OpenSCAD
+MESH_FORMATS = ['stl', '3mf']
+
+
+def scad_number(value):
+    """ format a number for OpenSCAD """
+    return '0' if value == 0 else f'{value:.10g}'
+
+
+class FlatOutputMixin:
+    """ Conversions resolving the reference tree in python
+
+    Mixed into LDrawConverter, relying on its settings, part loading and
+    batch handling.
+    """
+
+    def simplify(self, sections):
+        """ Drop conditional lines of parsed sections if simplified. """
+        if not self.simplified():
+            return sections
+        return {key: [command for command in commands if command[0] != 5]
+                for key, commands in sections.items()}
+
+    def load_lod(self, name):
+        """ Load a library file at the level of detail. """
+        return self.simplify(self.load_part(self.lod_name(name)))
+
+    def parse_model(self, ldrfile):
+        """ Parse a model file at the level of detail. """
+        return self.simplify(self.part_cache.get(
+            ldrfile, 'sections',
+            lambda filedata: geometry.parse(
+                filedata, self.make_function_name)))
+
+    def flattener(self):
+        """ Get a flattener for library parts.
+
+        The vectorized one is used if NumPy is available, unless the
+        numpy setting is turned off.
+        """
+        engine = arraygeometry.ArrayFlattener \
+            if self.settings['numpy'] and arraygeometry.numpy is not None \
+            else geometry.Flattener
+        return self.cached('flattener', lambda: engine(
+            self.load_lod, self.make_function_name))
+
+    @staticmethod
+    def flat_line(element):
+        """ Format an element of flattened geometry. """
+        face, points, color, step = element
+        return ('  [' + ('true' if face else 'false') + ',[' +
+                ','.join('[' + ','.join(scad_number(value)
+                                        for value in point) + ']'
+                         for point in points) +
+                '],' + str(color) + ',' + str(step) + '],')
+
+    @staticmethod
+    def mesh_line(entry):
+        """ Format a polyhedron assembled from flattened geometry. """
+        color, step, points, faces = entry
+        return ('  [' + str(color) + ',' + str(step) + ',[' +
+                ','.join('[' + ','.join(scad_number(value)
+                                        for value in point) + ']'
+                         for point in points) + '],[' +
+                ','.join('[' + ','.join(str(index) for index in face) + ']'
+                         for face in faces) + ']],')
+
+    def convert_flat(self, ldrfile, scadfile, self_contained=False):
+        """ Convert a single file into flattened geometry
+
+        The whole reference tree gets resolved during conversion, so
+        the result does not depend on any library parts. With the mesh
+        setting the faces are also assembled into a polyhedron per
+        color and STEP for solid objects, with close points merged if
+        the weld setting gives a tolerance.
+        """
+        sections = self.parse_model(ldrfile)
+        flat = self.flattener().flatten(sections)
+        function_name = self.make_function_name('__main__')
+        meshed = f", mesh={function_name}_mesh()" \
+            if self.settings['mesh'] else ''
+        with open(scadfile, 'w', encoding="utf-8") as output:
+            fdw = self.counted(output)
+            if self_contained:
+                fdw.write(self.model_colorfile(
+                    lambda: (element[2] for element in flat)))
+                fdw.write(self.cached('lib', self.lib_scad))
+                fdw.write(f"makepoly({function_name}(), "
+                          f"line={self.settings['line']}, flat=true"
+                          f"{meshed});\n")
+            else:
+                fdw.write(self.include(['lib'], '/') + '\n')
+            fdw.write(f"function {function_name}() = [")
+            for element in flat:
+                fdw.write('\n' + self.flat_line(element))
+            fdw.write('\n];')
+            if self.settings['bounds']:
+                for line in self.bounds_functions(
+                        function_name, geometry.step_bounds(flat)):
+                    fdw.write('\n' + line)
+            if self.settings['mesh']:
+                fdw.write(f"\nfunction {function_name}_mesh() = [")
+                for entry in mesh.assemble(flat, self.settings['weld']):
+                    fdw.write('\n' + self.mesh_line(entry))
+                fdw.write('\n];')
+            if not self_contained:
+                fdw.write(
+                    f"\nmodule {function_name}(step=0, col=false, "
+                    f"unit=2/5, alt=false, line=0.2, solid=!$preview)"
+                    f"\n    makepoly({function_name}(), step=step, "
+                    f"col=col, unit=unit, alt=alt, line=line, "
+                    f"solid=solid, flat=true{meshed});"
+                    f"\n{function_name}(line={self.settings['line']});")
+
+    def export_mesh(self, ldrfile, meshfile, fmt=None):
+        """ Export a single file as binary STL or 3MF mesh
+
+        Like convert_flat() the whole reference tree gets resolved, but
+        the triangles get written directly instead of OpenSCAD code. The
+        format is given by fmt or the extension of meshfile, 3MF files
+        get a material per color of the LDConfig table. Returns the
+        number of triangles.
+        """
+        fmt = (fmt or os.path.splitext(meshfile)[1][1:]).lower()
+        if fmt not in MESH_FORMATS:
+            raise ValueError(f'unknown mesh format {fmt}')
+        flattener = self.flattener()
+        with self.timer('flatten'):
+            sections = self.parse_model(ldrfile)
+            # arrays get exported without converting them into elements
+            flat = flattener.flatten_arrays(sections) \
+                if isinstance(flattener, arraygeometry.ArrayFlattener) \
+                else flattener.flatten(sections)
+        with self.timer('write'):
+            if fmt == 'stl':
+                return meshexport.write_stl(meshfile, flat)
+            colors = self.cached('color_tables', self.read_color_tables)
+            return meshexport.write_3mf(meshfile, flat, colors['LDConfig'],
+                                        tolerance=self.settings['weld'] or 0)
+
+    def flatten_file(self, name, ldrfile):
+        """ Flatten an enqueued file. """
+        if name != '__main__':
+            return self.flattener().flatten_part(name)
+        return self.flattener().flatten(self.parse_model(ldrfile))
+
+    @staticmethod
+    def bounds_functions(function_name, steps):
+        """ Format precomputed bounds of a file.
+
+        steps are the bounds of each STEP as returned by
+        geometry.step_bounds(). The functions replace bounds(),
+        center() and size() of lib.scad for the file.
+        """
+        boxes = ','.join(
+            '[' + ','.join('[' + ','.join(scad_number(value)
+                                          for value in point) + ']'
+                           for point in box) + ']' if box else 'false'
+            for box in steps)
+        return [
+            f"function {function_name}_bounds(step=0, unit=2/5) = "
+            f"stepbounds([{boxes}], step, unit);",
+            f"function {function_name}_center(step=0, unit=2/5) = "
+            f"boxcenter({function_name}_bounds(step, unit));",
+            f"function {function_name}_size(step=0, unit=2/5) = "
+            f"boxsize({function_name}_bounds(step, unit));"]
+
+    @staticmethod
+    def flat_function(function_name, flat):
+        """ Format flattened geometry as an OpenSCAD function. """
+        return ''.join([f"function {function_name}() = ["] +
+                       ['\n' + FlatOutputMixin.flat_line(element)
+                        for element in flat] + ['\n];\n'])
+
+    INSTANCE_PARAMETERS = ('col=col, unit=unit, alt=alt, line=line, '
+                           'solid=solid')
+
+    def instance_modules(self, instances):
+        """ Format part instances
+
+        Returns the definitions of the flattened parts and their
+        modules and the instance() calls placing them.
+        """
+        parameters = self.INSTANCE_PARAMETERS
+        parts = {}
+        modules = {}
+        body = []
+        for name, matrix, color, invert, step in instances:
+            part_name = self.make_function_name(name)
+            if part_name not in parts:
+                parts[part_name] = self.flat_function(
+                    part_name, self.flattener().flatten_part(name))
+            module_name = f'{part_name}_c{color}'.replace('-', 'm') + \
+                ('_i' if invert else '')
+            if module_name not in modules:
+                modules[module_name] = (
+                    f"module {module_name}(col=false, unit=2/5, alt=false, "
+                    f"line=0.2, solid=!$preview)\n"
+                    f"    makepoly(inherit({part_name}(), {color}"
+                    f"{', true' if invert else ''}), {parameters}, "
+                    f"flat=true);\n")
+            body.append(
+                "    instance([" +
+                ','.join('[' + ','.join(scad_number(value) for value in row)
+                         + ']' for row in matrix) +
+                f"], at={step}, step=step, unit=unit) "
+                f"{module_name}({parameters});\n")
+        return list(parts.values()) + list(modules.values()), body
+
+    def convert_instanced(self, ldrfile, scadfile, self_contained=False):
+        """ Convert a single file with shared library parts
+
+        Like convert_flat() but every library part referenced by the
+        model is flattened and written only once. Each distinct part
+        and color gets a module placed by instance() in lib.scad for
+        all references, so OpenSCAD can reuse its geometry.
+        """
+        sections = self.parse_model(ldrfile)
+        loose, instances = self.flattener().instances(sections)
+        definitions, body = self.instance_modules(instances)
+        function_name = self.make_function_name('__main__')
+        with open(scadfile, 'w', encoding="utf-8") as output:
+            fdw = self.counted(output)
+            if self_contained:
+                fdw.write(self.model_colorfile(
+                    lambda: (element[2] for element in
+                             self.flattener().flatten(sections))))
+                fdw.write(self.cached('lib', self.lib_scad))
+            else:
+                fdw.write(self.include(['lib'], '/') + '\n')
+            fdw.writelines(definitions)
+            fdw.write(self.flat_function(function_name, loose))
+            if self.settings['bounds']:
+                fdw.writelines(line + '\n' for line in
+                               self.bounds_functions(
+                                   function_name, geometry.step_bounds(
+                                       self.flattener().flatten(sections))))
+            fdw.write(f"module {function_name}(step=0, col=false, unit=2/5, "
+                      f"alt=false, line=0.2, solid=!$preview) {{\n"
+                      f"    makepoly({function_name}(), step=step, "
+                      f"{self.INSTANCE_PARAMETERS}, flat=true);\n")
+            fdw.writelines(body)
+            fdw.write(f"}}\n{function_name}(line={self.settings['line']});")
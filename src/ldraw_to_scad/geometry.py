@@ -0,0 +1,262 @@
+""" Resolve LDraw reference trees into flat geometry.
+
+This mirrors the translation done by lines() and l1() in lib.scad, so
+the result can be fed to makepoly(..., flat=true) without any further
+processing of the reference tree in OpenSCAD.
+
+Flattened geometry is a list of (face, points, color, step) tuples with
+face being True for faces and False for lines, points a tuple of (x, y,
+z) tuples in LDraw coordinates, color the LDraw color code and step the
+STEP the element got added in.
+"""
+
+
+MAIN = '__main__'
+
+IDENTITY = ((1, 0, 0, 0), (0, 1, 0, 0), (0, 0, 1, 0))
+
+# number of fields of line types 2 to 5 up to the last coordinate
+LINE_LENGTHS = {'2': 8, '3': 11, '4': 14, '5': 14}
+
+
+def color_code(value):
+    """ parse an LDraw color code """
+    return int(value, 0) if value[0:2] == '0x' else int(value)
+
+
+def points(values):
+    """ group a list of coordinates into points """
+    values = [float(value) for value in values]
+    return tuple(tuple(values[i:i+3]) for i in range(0, len(values), 3))
+
+
+def parse(lines, key):
+    """ Parse the lines of an LDraw file.
+
+    Returns a dictionary mapping section names to lists of commands.
+    The main section is stored as MAIN, further MPD subfiles by the
+    result of key(name), which should map names the same way they get
+    mapped to OpenSCAD functions. Commands are tuples:
+        (0, 'STEP')
+        (0, 'BFC', option)
+        (1, color, matrix, name)
+        (2 to 5, color, points)
+    with matrix being the 3x4 matrix ((a, b, c, x), (d, e, f, y),
+    (g, h, i, z)) of a type 1 line.
+    """
+    sections = {MAIN: []}
+    current = sections[MAIN]
+    implemented = False
+    for line in lines:
+        stripped = line.rstrip()
+        params = stripped.split(maxsplit=14)
+        if not params:
+            continue
+        if params[0] == '0':
+            if len(params) < 2:
+                continue
+            if params[1] == 'BFC':
+                current.extend((0, 'BFC', bfc) for bfc in params[2:])
+            elif params[1] == 'STEP':
+                current.append((0, 'STEP'))
+            elif params[1] == 'FILE':
+                name = key(stripped.split(maxsplit=2)[2])
+                if implemented:
+                    current = sections[name] = []
+                else:
+                    sections[name] = current
+                implemented = True
+            elif params[1] == 'NOFILE':
+                current = []
+                implemented = True
+        elif params[0] == '1':
+            values = [float(value) for value in params[2:14]]
+            current.append((
+                1, color_code(params[1]),
+                ((values[3], values[4], values[5], values[0]),
+                 (values[6], values[7], values[8], values[1]),
+                 (values[9], values[10], values[11], values[2])),
+                params[14].replace('/', '\\')))
+        elif params[0] in ('2', '3', '4', '5'):
+            current.append((int(params[0]), color_code(params[1]),
+                            points(params[2:LINE_LENGTHS[params[0]]])))
+    return sections
+
+
+def det3(matrix):
+    """ calculate the determinant of the 3x3 part of a matrix """
+    (m00, m01, m02, _), (m10, m11, m12, _), (m20, m21, m22, _) = matrix
+    return (m00 * m11 * m22 + m01 * m12 * m20 + m02 * m10 * m21 -
+            m02 * m11 * m20 - m01 * m10 * m22 - m00 * m12 * m21)
+
+
+def transform(matrix, point):
+    """ apply a 3x4 matrix to a point """
+    x, y, z = point  # pylint: disable=invalid-name
+    return tuple(row[0] * x + row[1] * y + row[2] * z + row[3]
+                 for row in matrix)
+
+
+def compose(outer, inner):
+    """ combine two 3x4 matrices into one applying inner first """
+    return tuple(
+        tuple(sum(row[k] * inner[k][j] for k in range(3)) +
+              (row[3] if j == 3 else 0) for j in range(4))
+        for row in outer)
+
+
+def inherit_color(color, col):
+    """ replace the color of a subpart element as l1() in lib.scad """
+    if color == 16:
+        return col
+    if color == 24:
+        return 24 if col == 16 else 16 if col == 24 else -col-1
+    return color
+
+
+def place(matrix, geometry, col, invert, step):
+    """ transform flattened subpart geometry according to a type 1 line """
+    flip = (det3(matrix) < 0) != invert
+    return [(face,
+             tuple(transform(matrix, point)
+                   for point in (pts[::-1] if face and flip else pts)),
+             inherit_color(color, col),
+             step)
+            for face, pts, color, _ in geometry]
+
+
+def step_bounds(flat):
+    """ get the bounds of the faces of flattened geometry per STEP
+
+    Returns a list with entry k being ((min x, min y, min z), (max x,
+    max y, max z)) of all faces added up to STEP k, or None as long as
+    there are no faces, as bounds() in lib.scad with step k+1.
+    """
+    steps = {}
+    for face, pts, _, step in flat:
+        if face:
+            steps.setdefault(step, []).extend(pts)
+    result = []
+    box = None
+    for step in range(max(steps, default=0) + 1):
+        for point in steps.get(step, ()):
+            if box is None:
+                box = (point, point)
+            else:
+                box = (tuple(map(min, box[0], point)),
+                       tuple(map(max, box[1], point)))
+        result.append(box)
+    return result
+
+
+def walk(commands):
+    """ track the meta state of a section as lines() in lib.scad
+
+    Yields (command, step, ccw, invert) for every command besides the
+    meta commands.
+    """
+    step, ccw, invert = 0, True, False
+    for command in commands:
+        if command[0] != 0:
+            yield command, step, ccw, invert
+            invert = False
+        elif command[1] == 'STEP':
+            step, invert = step + 1, False
+        else:
+            ccw = {'CCW': True, 'CW': False}.get(command[2], ccw)
+            invert = command[2] == 'INVERTNEXT'
+
+
+def primitive(command, step, ccw):
+    """ get the flattened element of a type 2 to 5 line """
+    if command[0] in (3, 4):
+        return (True, command[2][::-1] if ccw else command[2], command[1],
+                step)
+    return (False, command[2], command[1], step)
+
+
+class Flattener:
+    """ Flatten LDraw reference trees
+
+    load(name) must return the parsed sections of a library file and
+    key(name) the section name of a reference as used by parse().
+    Flattened library parts are kept in self.parts and reused.
+    """
+
+    def __init__(self, load, key):
+        self.load = load
+        self.key = key
+        self.parts = {}
+
+    def resolve(self, name, sections, stack):
+        """ get the flattened geometry of a referenced (sub)file """
+        key = self.key(name)
+        if key in stack:
+            raise ValueError(f'circular reference to {name}')
+        if key in sections:
+            return self.lines(sections[key], sections, stack + (key,))
+        if key not in self.parts:
+            part = self.load(name)
+            self.parts[key] = self.lines(part[MAIN], part, stack + (key,))
+        return self.parts[key]
+
+    def lines(self, commands, sections, stack=()):
+        """ flatten a list of commands as lines() in lib.scad """
+        result = []
+        for command, step, ccw, invert in walk(commands):
+            if command[0] == 1:
+                result.extend(place(
+                    command[2],
+                    self.resolve(command[3], sections, stack),
+                    command[1], invert, step))
+            else:
+                result.append(primitive(command, step, ccw))
+        return result
+
+    def flatten(self, sections):
+        """ flatten the main section of a parsed file """
+        return self.lines(sections[MAIN], sections, (MAIN,))
+
+    def flatten_part(self, name):
+        """ flatten a library file """
+        return self.resolve(name, {}, ())
+
+    def instances(self, sections):
+        """ split a parsed file into loose geometry and part instances
+
+        MPD subfiles get resolved, but references to library files are
+        returned as a list of (name, matrix, color, invert, step)
+        instances in coordinates of the main section instead of being
+        flattened. Placing the flattened part with place() gives the
+        same geometry as flatten().
+        """
+        result = ([], [])
+        self.collect(sections[MAIN], sections, (MAIN,), result, None)
+        return result
+
+    def collect(self, commands, sections, stack, result, outer):
+        """ collect loose geometry and instances of a section
+
+        outer is the (matrix, color, invert, step) the section is
+        placed with or None for the main section.
+        """
+        for command, step, ccw, invert in walk(commands):
+            if outer is None:
+                matrix, col, inverted = IDENTITY, 16, False
+            else:
+                matrix, col, inverted, step = outer
+            if command[0] != 1:
+                result[0].extend(place(matrix, [primitive(command, step, ccw)],
+                                       col, inverted, step))
+                continue
+            placement = (compose(matrix, command[2]),
+                         inherit_color(command[1], col),
+                         inverted != invert, step)
+            key = self.key(command[3])
+            if key in stack:
+                raise ValueError(f'circular reference to {command[3]}')
+            if key in sections:
+                self.collect(sections[key], sections, stack + (key,), result,
+                             placement)
+            else:
+                result[1].append((command[3],) + placement)
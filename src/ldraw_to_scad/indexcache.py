@@ -0,0 +1,68 @@
+""" Persistent cache of the library index. """
+
+import os
+import json
+import hashlib
+import tempfile
+
+
+# folders of the library that get indexed, with the prefix of their
+# entries in the index
+INDEX_DIRS = {
+    'models': '',
+    'parts': '',
+    'p': '',
+    os.path.join('parts', 's'): 's\\',
+    os.path.join('p', '48'): '48\\',
+    os.path.join('p', '8'): '8\\'
+}
+
+
+def default_cache_file(libdir):
+    """ get the default cache file for a library """
+    cachedir = os.environ.get('XDG_CACHE_HOME',
+                              os.path.join(os.path.expanduser('~'), '.cache'))
+    libhash = hashlib.sha256(
+        os.path.abspath(libdir).encode('utf-8')).hexdigest()
+    return os.path.join(cachedir, 'ldraw-to-scad', f'index-{libhash}.json')
+
+
+def cache_key(libdir):
+    """ get the modification times of the indexed folders
+
+    Returns None if any of them cannot be accessed.
+    """
+    try:
+        return {sub_path: os.stat(os.path.join(libdir, sub_path)).st_mtime_ns
+                for sub_path in INDEX_DIRS}
+    except OSError:
+        return None
+
+
+def load_index(filename, libdir, key):
+    """ load a cached index, None if missing or outdated """
+    try:
+        with open(filename, encoding="utf-8") as filedata:
+            data = json.load(filedata)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(data, dict) or \
+       data.get('library_root') != os.path.abspath(libdir) or \
+       data.get('key') != key:
+        return None
+    return {name: tuple(location)
+            for name, location in data.get('index', {}).items()}
+
+
+def save_index(filename, libdir, key, index):
+    """ store an index in the cache, ignoring failures """
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+                'w', encoding="utf-8", dir=os.path.dirname(filename),
+                delete=False) as fdw:
+            json.dump({'library_root': os.path.abspath(libdir),
+                       'key': key, 'index': index}, fdw)
+        os.replace(fdw.name, filename)
+    except OSError:
+        pass
@@ -2,15 +2,81 @@
 
 """ Translate LDraw library or file to OpenSCAD library or file. """
 
+import io
 import os
+import time
+import functools
+import heapq
+import shutil
+import tempfile
+import itertools
+import threading
+import collections
+import multiprocessing
+import concurrent.futures
 import importlib_resources
+from .manifest import LibraryManifest
+from .depgraph import DependencyGraph
+from .partcache import PART_CACHE
+from . import indexcache
+from . import geometry
+from . import partstore
+from .flatoutput import FlatOutputMixin
+from .stats import ConversionStats, CountingWriter, NoTimer
+from .colors import read_colors, color_table
+from .libraryfs import open_library
+from .geometry import LINE_LENGTHS
 
 
-class LDrawConverter:
+_WORKER = {}
+
+# timer used while statistics are disabled
+NO_TIMER = NoTimer()
+
+# prefixes of the primitive variants used for the levels of detail
+LOD_PREFIXES = {'low': '8\\', 'high': '48\\'}
+
+# simpler replacements of studs used at low level of detail
+STUD_SIMPLIFICATIONS = {'stud2.dat': 'stud.dat', 'stud2a.dat': 'stud.dat'}
+
+# characters of LDraw names not valid in OpenSCAD identifiers
+FUNCTION_NAME_CHARS = str.maketrans({
+    '\\': '__', '-': '_', '+': '_', ' ': '_', '#': '_'})
+
+
+def _init_worker(settings, index, stats):
+    """ set up the converter of a worker process """
+    _WORKER['converter'] = LDrawConverter(settings['library_root'], index,
+                                          stats=stats)
+    _WORKER['converter'].settings.update(settings)
+    # flattened parts are reused for the bounds of all files of a worker
+    _WORKER['converter'].batch = {}
+
+
+def _process_entries(entries):
+    """ translate a batch of queue entries in a worker process """
+    converter = _WORKER['converter']
+    for entry in entries:
+        converter.enqueue(*entry)
+    converter.process_queue()
+    deps, converter.deps = converter.deps, {}
+    if converter.stats is None:
+        return deps, None
+    stats = converter.stats.to_dict()
+    converter.stats = ConversionStats(converter.part_cache)
+    return deps, stats
+
+
+class LDrawConverter(FlatOutputMixin):
     """ Convert LDraw files to OpenSCAD """
+    # pylint: disable=too-many-public-methods,too-many-instance-attributes
+
+    # size of a translated file body kept in memory before spilling to disk
+    SPOOL_SIZE = 1 << 20
 
-    def __init__(self, libdir=os.path.join('lib', 'ldraw')):
-        self.queue = ({}, set())
+    def __init__(self, libdir=os.path.join('lib', 'ldraw'), index=None,
+                 index_cache=True, lazy=False, stats=False):
+        self.queue = ({}, set(), [])
         self.filedep = None
         self.settings = {
             'library_root': libdir,
@@ -18,89 +84,179 @@ class LDrawConverter:
             'scadlibname': 'LDraw',
             'selfcontained': None,
             'line': 0.2,
-            'commented': True}
+            'commented': True,
+            'numpy': True,
+            'mesh': False,
+            'weld': None,
+            'bounds': False,
+            'steps': False,
+            'lod': 'normal',
+            'simplify': False,
+            'used_colors': False,
+            'io_threads': 0}
         self.mpd_main = None
-        self.index = self.index_library()
+        self.step_split = None
+        self.file_bounds = None
+        self.file_colors = None
+        self.used_colors = None
+        self.writer = None
+        self.made_dirs = set()
+        self.made_dirs_lock = threading.Lock()
+        self.deps = {}
+        self.batch = None
+        self.part_cache = PART_CACHE
+        self.files = open_library(libdir)
+        self.stats = ConversionStats(self.part_cache) if stats else None
+        self.store = None
+        self.index_cache = index_cache
+        self.missing = set()
+        self.lazy = lazy and index is None
+        if self.lazy:
+            self.index = {}
+        else:
+            self.index = self.load_index(index_cache) if index is None \
+                else index
 
     def set(self, key, value):
         """ change a setting """
         self.settings[key] = value
 
-    def colorfile(self):
-        """ Translate color specifications. """
+    def timer(self, phase):
+        """ Time a phase of the conversion if statistics are enabled. """
+        return NO_TIMER if self.stats is None else self.stats.timer(phase)
+
+    def counted(self, fdw):
+        """ Count the writes to an output file if statistics are enabled. """
+        return fdw if self.stats is None else CountingWriter(fdw, self.stats)
+
+    def colorfile(self, codes=None):
+        """ Translate color specifications.
+
+        With codes given only the colors used by lines of those color
+        codes get translated.
+        """
+        with self.timer('colors'):
+            return self.translate_colors(codes)
+
+    def read_color_tables(self):
+        """ Read the color tables of the library. """
+        tables = {}
+        for colfile in ['LDConfig', 'LDCfgalt']:
+            with self.files.open(os.path.join(
+                    self.settings['library_root'], colfile+'.ldr')) \
+                    as filedata:
+                tables[colfile] = read_colors(filedata)
+        return tables
+
+    def translate_colors(self, codes=None):
+        """ Translate the color tables of the library. """
         coltxt = ('function ldraw_color(id, alt=false) = alt ?'
                   ' ldraw_color_LDCfgalt(id) :'
                   ' ldraw_color_LDConfig(id);\n')
-        for colfile in ['LDConfig', 'LDCfgalt']:
-            with open(os.path.join(self.settings['library_root'],
-                                   colfile+'.ldr'),
-                      encoding="utf-8", errors='replace') as filedata:
-                lines = filedata.readlines()
-            colors = [f'function ldraw_color_{colfile}(id) = (']
-            for line in lines:
-                params = line.split()
-                if len(params) >= 2 and params[0] == '0' and \
-                   params[1] == '!COLOUR':
-                    data = {}
-                    if len(params) == 2:
-                        print('!COLOUR line with no data!')
-                    data['name'] = params[2]
-                    skip = False
-                    for pos, opt in enumerate(params[3:]):
-                        if skip:
-                            skip = False
-                            continue
-                        if opt in ['CODE', 'VALUE', 'ALPHA', 'LUMINANCE',
-                                   'EDGE']:
-                            data[opt] = params[pos+4]
-                            skip = True
-                        elif opt in ['METAL', 'RUBBER', 'PEARLESCENT',
-                                     'CHROME', 'MATTE_METALLIC']:
-                            data[opt] = True
-                        elif opt == 'MATERIAL':
-                            data[opt] = params[pos+1:]
-                            break
-                        else:
-                            print(f'Unknown !COLOUR option {opt}!')
-                    alpha = int(data["ALPHA"]) if "ALPHA" in data else 255
-                    colors.append(
-                        f'(id=={data["CODE"]}) ? ["{data["VALUE"]}{alpha:02X}'
-                        f'","{data["EDGE"]}"] : (')
-            colors.append('(id>=2*16^6) ? [chr(35, [for (i=[5:-1:0])'
-                          'let(n=floor(id/16^i)%16) n+(n<10?48:55)]),'
-                          'chr(35, [for (i=[5:-1:0])'
-                          'let(n=15-floor(id/16^i)%16) n+(n<10?48:55)])] :'
-                          '"UNKNOWN"'+')'*len(colors)+';')
-            coltxt += '\n'.join(colors) + '\n'
+        tables = self.cached('color_tables', self.read_color_tables)
+        for colfile, colors in tables.items():
+            coltxt += color_table(colfile, colors, codes)
         return coltxt
 
+    def model_colorfile(self, codes):
+        """ Translate the colors of a self-contained model.
+
+        With the used_colors setting only the colors of the codes
+        returned by codes() get translated, otherwise all of them once
+        per batch.
+        """
+        if self.settings['used_colors']:
+            return self.colorfile(codes())
+        return self.cached('colors', self.colorfile)
+
+    @staticmethod
+    def lib_scad():
+        """ Read the OpenSCAD library shipped with the converter. """
+        libref = importlib_resources.files(__name__) / 'lib.scad'
+        with importlib_resources.as_file(libref) as libpath:
+            with open(libpath, encoding="utf-8") as filedata:
+                return filedata.read()
+
+    def cached(self, key, function):
+        """ Call function once per batch conversion. """
+        if self.batch is None:
+            return function()
+        if key not in self.batch:
+            self.batch[key] = function()
+        return self.batch[key]
+
     def index_library(self):
         """ Index the whole library. """
         index = {}
-        for sub_path in ['models', 'parts', 'p']:
+        for sub_path, prefix in indexcache.INDEX_DIRS.items():
             whole_path = os.path.join(self.settings['library_root'], sub_path)
-            for item in os.listdir(whole_path):
+            for item in self.files.listdir(whole_path):
                 if item.endswith('.dat'):
-                    index[item] = (sub_path, os.path.splitext(item)[0])
-        special_subs = {
-            's': os.path.join('parts', 's'),
-            '48': os.path.join('p', '48'),
-            '8': os.path.join('p', '8')
-        }
-        for prefix, s_path in special_subs.items():
-            for item in os.listdir(os.path.join(self.settings['library_root'],
-                                                s_path)):
-                if item.endswith('.dat'):
-                    index[prefix + '\\'+item] = (s_path,
-                                                 os.path.splitext(item)[0])
+                    index[prefix + item] = (sub_path,
+                                            os.path.splitext(item)[0])
         return index
 
+    def load_index(self, cache=True):
+        """ Index the library using a persistent cache.
+
+        cache may be False to disable the cache, True to use the
+        default cache file or the name of the cache file. The cache is
+        invalidated when any of the indexed folders got modified.
+        """
+        with self.timer('index'):
+            libdir = self.settings['library_root']
+            key = indexcache.cache_key(libdir) if cache else None
+            if key is None:
+                return self.index_library()
+            filename = indexcache.default_cache_file(libdir) \
+                if cache is True else cache
+            index = indexcache.load_index(filename, libdir, key)
+            if index is None:
+                index = self.index_library()
+                indexcache.save_index(filename, libdir, key, index)
+            return index
+
+    def full_index(self):
+        """ Make sure the whole library is indexed. """
+        if self.lazy:
+            self.index = self.load_index(self.index_cache)
+            self.missing.clear()
+            self.lazy = False
+
+    def probe_part(self, part_name):
+        """ Look up a part in the library folders on demand.
+
+        Folders are tried in reverse order of index_library(), so a part
+        found in several folders resolves to the same location as with
+        the whole library indexed.
+        """
+        prefix, sep, item = part_name.rpartition('\\')
+        prefix = (prefix + sep).lower()
+        for sub_path, sub_prefix in reversed(indexcache.INDEX_DIRS.items()):
+            if sub_prefix != prefix:
+                continue
+            for candidate in [item, item.lower()]:
+                if candidate.endswith('.dat') and self.files.isfile(
+                        os.path.join(self.settings['library_root'],
+                                     sub_path, candidate)):
+                    return (sub_path, os.path.splitext(candidate)[0])
+        return None
+
     def find_part(self, part_name):
         """ Find a part in the library. """
         try:
             filename = self.index[part_name]
         except KeyError:
-            filename = self.index[part_name.lower()]
+            try:
+                filename = self.index[part_name.lower()]
+            except KeyError:
+                if not self.lazy or part_name in self.missing:
+                    raise
+                filename = self.probe_part(part_name)
+                if filename is None:
+                    self.missing.add(part_name)
+                    raise
+                self.index[part_name] = filename
         return filename
 
     def implement_function(self, function):
@@ -131,21 +287,78 @@ class LDrawConverter:
         return self.filedep[0]
 
     @staticmethod
+    @functools.lru_cache(maxsize=8192)
     def make_function_name(name):
         """ Calculate OpenSCAD name from LDraw name. """
         function_name = name.lower().split('.', 1)[0]
-        function_name = function_name.replace('\\', '__').replace('-', '_').\
-            replace('+', '_').replace(' ', '_').replace('#', '_')
-        return 'ldraw_lib__' + function_name
+        return 'ldraw_lib__' + function_name.translate(FUNCTION_NAME_CHARS)
+
+    def simplified(self):
+        """ Check whether details get dropped at low level of detail. """
+        return self.settings['lod'] == 'low' and self.settings['simplify']
+
+    def lod_name(self, name):
+        """ Get the reference to a part at the level of detail.
+
+        Primitives are replaced by their low or high resolution variant
+        if the library has one, studs by simpler ones if details get
+        dropped.
+        """
+        if self.simplified() and name.lower() in STUD_SIMPLIFICATIONS:
+            try:
+                self.find_part(STUD_SIMPLIFICATIONS[name.lower()])
+                name = STUD_SIMPLIFICATIONS[name.lower()]
+            except KeyError:
+                pass
+        prefix = LOD_PREFIXES.get(self.settings['lod'])
+        if prefix is None or '\\' in name:
+            return name
+        try:
+            if self.find_part(name)[0] == 'p':
+                self.find_part(prefix + name)
+                return prefix + name
+        except KeyError:
+            pass
+        return name
+
+    def split_step(self, result, params):
+        """ Track a '0' line of the main section of a split file.
+
+        Returns whether the line got translated, which is the case for
+        STEP, as it starts the function of the next step.
+        """
+        split = self.step_split
+        if split is None or not split['open']:
+            return False
+        meta = params[1]
+        if meta == 'BFC':
+            for bfc in params[2:]:
+                split['ccw'] = {'CCW': True, 'CW': False}.get(
+                    bfc, split['ccw'])
+        elif meta == 'NOFILE' or meta == 'FILE' and self.filedep[1]:
+            split['open'] = False
+        elif meta == 'STEP':
+            # the next step starts in the same BFC state
+            result.append("];")
+            result.append(f"function {split['name']}_step{split['steps']}() "
+                          f"= [")
+            if not split['ccw']:
+                result.append('  [0,"BFC","CW"],')
+            split['steps'] += 1
+            return True
+        return False
 
     def convert_line_0(self, result, params, stripped):
         """ Translate a '0' line. """
-        if len(params) >= 2 and params[1] == 'BFC':
+        if len(params) < 2 or self.split_step(result, params):
+            return
+        meta = params[1]
+        if meta == 'BFC':
             for bfc in params[2:]:
-                result.append(f'  [0,"BFC","{bfc}"],')
-        if len(params) >= 2 and params[1] == 'STEP':
+                result.append('  [0,"BFC","' + bfc + '"],')
+        elif meta == 'STEP':
             result.append('  [0,"STEP"],')
-        if len(params) >= 2 and params[1] == 'FILE':
+        elif meta == 'FILE':
             intfile = stripped.split(maxsplit=2)[2]
             if self.implement_function(intfile):
                 self.mpd_main = intfile
@@ -153,7 +366,7 @@ class LDrawConverter:
                 result.append("];")
                 intfile_name = LDrawConverter.make_function_name(intfile)
                 result.append(f"function {intfile_name}() = [")
-        if len(params) >= 2 and params[1] == 'NOFILE':
+        elif meta == 'NOFILE':
             intfile = self.get_dummy()
             result.append("];")
             intfile_name = LDrawConverter.make_function_name(intfile)
@@ -162,25 +375,34 @@ class LDrawConverter:
     def convert_line(self, part_line):
         """ Translate a single line. """
         stripped = part_line.rstrip()
-        result = [f"// {stripped}"] if self.settings['commented'] else []
+        result = ['// ' + stripped] if self.settings['commented'] else []
         params = stripped.split(maxsplit=14)
         if not params:
             return result
-        if params[0] == "0":
-            self.convert_line_0(result, params, stripped)
-        elif params[0] == "1":
+        line_type = params[0]
+        if line_type == "1":
             keyname = params[14].replace('/', '\\')
+            if self.settings['lod'] != 'normal':
+                keyname = self.lod_name(keyname)
             self.add_dep(keyname)
-            if params[1][0:3] == '0x2':
+            if params[1].startswith('0x2'):
                 params[1] = str(int(params[1], 0))
-            result.append(
-                f"  [{','.join(params[:14])}, "
-                f"{LDrawConverter.make_function_name(keyname)}()],")
-        elif params[0] in ["2", "3", "4", "5"]:
-            if params[1][0:3] == '0x2':
+            if self.file_colors is not None:
+                self.file_colors.add(params[1])
+            params[14] = LDrawConverter.make_function_name(keyname)
+            result.append('  [' + ','.join(params[:14]) + ', ' +
+                          params[14] + '()],')
+        elif line_type in LINE_LENGTHS:
+            if line_type == '5' and self.simplified():
+                return result
+            if params[1].startswith('0x2'):
                 params[1] = str(int(params[1], 0))
-            outparams = params[:{'2': 8, '3': 11, '4': 14, '5': 14}[params[0]]]
-            result.append(f"  [{','.join(outparams)}],")
+            if self.file_colors is not None:
+                self.file_colors.add(params[1])
+            result.append(
+                '  [' + ','.join(params[:LINE_LENGTHS[line_type]]) + '],')
+        elif line_type == "0":
+            self.convert_line_0(result, params, stripped)
         return result
 
     def include(self, comp, path):
@@ -190,122 +412,531 @@ class LDrawConverter:
             else os.path.relpath(os.path.join(*comp), path))
         return f'use <{relpath}.scad>'
 
-    def process_lines(self, name, path, lines):
-        """ Translate all lines of a file. """
+    def translate_lines(self, lines, name=None):
+        """ Translate the lines of a file one by one.
+
+        This is a generator yielding the translated body of the file.
+        The dependencies are only complete once it is exhausted. With
+        the steps setting the main section of the main file is split
+        into a function per STEP.
+        """
         self.filedep = (set(), set())
         self.mpd_main = None
-        result = []
+        self.step_split = {
+            'name': LDrawConverter.make_function_name(name), 'steps': 1,
+            'ccw': True, 'open': True} \
+            if self.settings['steps'] and name == '__main__' else None
+        self.file_colors = set() if self.used_colors is not None else None
+        if self.stats is not None:
+            lines = self.stats.count_lines(lines)
         for line in lines:
-            result.extend(self.convert_line(line))
+            yield from self.convert_line(line)
+
+    def step_functions(self, function_name):
+        """ Generate the cumulative function and modules of a split file.
+
+        Every STEP gets a module of its own, so showing a step only
+        evaluates the geometry of the steps up to it.
+        """
+        steps = [f"{function_name}_step{step}"
+                 for step in range(self.step_split['steps'])]
+        parameters = 'col=col, unit=unit, alt=alt, line=line, solid=solid'
+        result = [f"function {function_name}() = concat(" +
+                  ', [[0,"STEP"]], '.join(f"{step}()" for step in steps) +
+                  ");"]
+        for step in steps:
+            result.append(f"module {step}(col=false, unit=2/5, alt=false, "
+                          f"line=0.2, solid=!$preview)")
+            result.append(f"    makepoly({step}(), {parameters});")
+        result.append(f"module {function_name}(step=0, col=false, unit=2/5, "
+                      f"alt=false, line=0.2, solid=!$preview) {{")
+        for number, step in enumerate(steps):
+            result.append(f"    if(step == 0 || {number} < step) "
+                          f"{step}({parameters});")
+        result.append("}")
+        return result
+
+    def file_header(self, name, path):
+        """ Generate the lines preceding the translated body.
+
+        Must be called after the body got translated as it relies on
+        the dependencies of the file.
+        """
+        function_name = LDrawConverter.make_function_name(name)
+        if self.step_split is not None:
+            function_name += '_step0'
+        if self.settings['selfcontained']:
+            return [f"function {function_name}() = ["]
+        return [self.include(['lib'], path)] + \
+               [self.include(self.find_part(name), path)
+                for name in sorted(self.get_deps())] + \
+               [f"function {function_name}() = ["]
+
+    def file_footer(self, name, path):
+        """ Generate the lines following the translated body. """
         function_name = LDrawConverter.make_function_name(name)
         if self.settings['selfcontained']:
             for file in self.get_deps():
                 self.enqueue(file, path)
-            result = [f"function {function_name}() = ["] + result + ["];"]
+        if self.step_split is not None:
+            result = ["];"] + self.step_functions(function_name)
+            if not self.settings['selfcontained']:
+                result.append(
+                    f"{function_name}(line={self.settings['line']});")
+        elif self.settings['selfcontained']:
+            result = ["];"]
         else:
-            result = [self.include(['lib'], path)] + \
-                     [self.include(self.find_part(name), path)
-                      for name in sorted(self.get_deps())] + \
-                     [f"function {function_name}() = ["] + result + ["];"] + \
+            result = ["];"] + \
                      [f"module {function_name}(step=0, col=false, unit=2/5, "
                       f"alt=false, line=0.2, solid=!$preview)"] + \
                      [f"    makepoly({function_name}(), step=step, col=col, "
                       f"unit=unit, alt=alt, line=line, solid=solid);"] + \
                      [f"{function_name}(line={self.settings['line']});"]
+        if self.file_bounds is not None:
+            result.extend(LDrawConverter.bounds_functions(
+                function_name, self.file_bounds))
         if self.mpd_main and self.mpd_main != name:
             main_function = LDrawConverter.make_function_name(self.mpd_main)
             result.append(f"function {main_function}() = {function_name}();")
+            if self.file_bounds is not None:
+                result.extend(
+                    f"function {main_function}_{kind}(step=0, unit=2/5) = "
+                    f"{function_name}_{kind}(step, unit);"
+                    for kind in ['bounds', 'center', 'size'])
             result.append(f"module {main_function}(step=0, col=false, "
                           f"unit=2/5, alt=false, line=0.2, solid=!$preview)")
             result.append(f"    {function_name}(step=step, col=col, "
                           f"unit=unit, alt=alt, line=line, solid=solid);")
         return result
 
+    def process_lines(self, name, path, lines):
+        """ Translate all lines of a file. """
+        result = list(self.translate_lines(lines, name))
+        return self.file_header(name, path) + result + \
+            self.file_footer(name, path)
+
+    def write_lines(self, name, path, lines, fdw):
+        """ Translate all lines of a file and write them to fdw.
+
+        The body is streamed through a spooled temporary file while
+        the dependencies needed for the header get collected, so memory
+        use does not grow with the size of the file.
+        """
+        if self.settings['selfcontained']:
+            fdw.write(self.file_header(name, path)[0])
+            for line in self.translate_lines(lines, name):
+                fdw.write('\n' + line)
+        else:
+            with tempfile.SpooledTemporaryFile(
+                    self.SPOOL_SIZE, 'w+', encoding="utf-8") as body:
+                for line in self.translate_lines(lines, name):
+                    body.write('\n' + line)
+                fdw.write('\n'.join(self.file_header(name, path)))
+                body.seek(0)
+                shutil.copyfileobj(body, fdw)
+        for line in self.file_footer(name, path):
+            fdw.write('\n' + line)
+
+    def library_files(self, name):
+        """ get source and translated file of a library file """
+        lpath, base = self.find_part(name)
+        return (os.path.join(self.settings['library_root'], lpath, base) +
+                ('.dat' if lpath != 'models' else '.ldr'),
+                os.path.join(self.settings['scadlibs'],
+                             self.settings['scadlibname'],
+                             lpath, base) + '.scad')
+
     def enqueue(self, name, path=None, ldrfile=None, scadfile=None):
         """ enqueue a file to be processed """
         if name not in self.queue[1]:
+            if name not in self.queue[0]:
+                heapq.heappush(self.queue[2], name)
             lpath = None
-            base = None
             if not ldrfile:
-                lpath, base = self.find_part(name)
-            self.queue[0][name] = (
-                path if path else lpath,
-                (ldrfile if ldrfile else
-                 os.path.join(self.settings['library_root'], lpath, base) +
-                 ('.dat' if lpath != 'models' else '.ldr')),
-                (scadfile if scadfile else
-                 os.path.join(self.settings['scadlibs'],
-                              self.settings['scadlibname'],
-                              lpath, base) + '.scad'))
+                lpath = self.find_part(name)[0]
+                ldrfile, libscadfile = self.library_files(name)
+                scadfile = scadfile if scadfile else libscadfile
+            self.queue[0][name] = (path if path else lpath, ldrfile,
+                                   scadfile)
+
+    def dequeue(self):
+        """ take the enqueued file with the lowest name off the queue """
+        name = heapq.heappop(self.queue[2])
+        self.queue[1].add(name)
+        return (name,) + self.queue[0].pop(name)
+
+    def makedirs(self, scaddir):
+        """ create a directory unless it got created during this run
+
+        Writer threads of a pipelined run share the created directories.
+        The parents created along with a directory count as created too.
+        """
+        if not scaddir:
+            return
+        with self.made_dirs_lock:
+            if scaddir not in self.made_dirs:
+                os.makedirs(scaddir, exist_ok=True)
+                while scaddir and scaddir not in self.made_dirs:
+                    self.made_dirs.add(scaddir)
+                    scaddir = os.path.dirname(scaddir)
+
+    def write_output(self, scadfile, text):
+        """ write a translated file """
+        with self.timer('write'):
+            self.makedirs(os.path.dirname(scadfile))
+            with open(scadfile, 'w', encoding="utf-8") as fdw:
+                self.counted(fdw).write(text)
+
+    def write_translation(self, name, path, lines, scadfile):
+        """ translate lines of an enqueued file
+
+        In a pipelined run the translation is handed to the writer
+        instead of being written right away.
+        """
+        if self.settings['selfcontained']:
+            self.write_lines(name, path, lines,
+                             self.settings['selfcontained'])
+        elif self.writer is not None:
+            output = io.StringIO()
+            self.write_lines(name, path, lines, output)
+            self.writer(scadfile, output.getvalue())
+        else:
+            self.makedirs(os.path.dirname(scadfile))
+            with open(scadfile, 'w', encoding="utf-8") as fdw:
+                self.write_lines(name, path, lines, self.counted(fdw))
+
+    def read_file(self, name, ldrfile):
+        """ read the lines of an enqueued library file """
+        if name == '__main__':
+            return None
+        with self.timer('read'):
+            return self.part_cache.get(ldrfile, 'lines', list, self.files)
+
+    def write_file(self, name, path, ldrfile, scadfile, lines=None):
+        """ translate a single enqueued file
+
+        Library files are read through the part cache unless their lines
+        are given, the main file is streamed as it can be arbitrarily
+        large.
+        """
+        start = time.perf_counter()
+        with self.timer('translate'):
+            with self.timer('bounds'):
+                self.file_bounds = geometry.step_bounds(
+                    self.flatten_file(name, ldrfile)) \
+                    if self.settings['bounds'] else None
+            if name == '__main__':
+                with open(ldrfile, encoding="utf-8",
+                          errors='replace') as filedata:
+                    self.write_translation(name, path, filedata, scadfile)
+            else:
+                self.write_translation(
+                    name, path,
+                    self.read_file(name, ldrfile) if lines is None else lines,
+                    scadfile)
+        self.deps[name] = sorted(self.get_deps())
+        if self.used_colors is not None:
+            self.used_colors.update(self.file_colors)
+        if self.stats is not None:
+            # the size of the source, which may come from the part cache
+            self.stats.count('source_bytes', self.files.stat(ldrfile)[1])
+            self.stats.file_done(ldrfile, time.perf_counter() - start)
 
     def process_queue(self):
-        """ process enqueued files """
+        """ process enqueued files
+
+        Outside of a batch conversion a batch is opened for the run, so
+        parts flattened for bounds get reused for all files.
+        """
+        if self.batch is None:
+            self.batch = {}
+            try:
+                self.process_queue()
+            finally:
+                self.batch = None
+            return
+        self.made_dirs.clear()
+        if self.settings['io_threads'] and not self.settings['selfcontained']:
+            self.process_queue_pipelined(self.settings['io_threads'])
+            return
         while self.queue[0]:
-            name = sorted(self.queue[0].keys())[0]
-            path, ldrfile, scadfile = self.queue[0].pop(name)
-            self.queue[1].add(name)
-            with open(ldrfile, encoding="utf-8", errors='replace') as filedata:
-                lines = filedata.readlines()
-            result = '\n'.join(self.process_lines(name, path, lines))
-            if self.settings['selfcontained']:
-                self.settings['selfcontained'].write(result)
+            name, path, ldrfile, scadfile = self.dequeue()
+            if not self.settings['selfcontained'] or \
+               'translated' not in self.batch or name == '__main__':
+                self.write_file(name, path, ldrfile, scadfile)
+                continue
+            # translations of dependencies get reused within a batch,
+            # as long as their source did not change
+            signature = self.files.stat(ldrfile)
+            if self.batch['translated'].get(name, (None,) * 4)[3] != \
+                    signature:
+                output = self.settings['selfcontained']
+                self.settings['selfcontained'] = io.StringIO()
+                try:
+                    self.write_file(name, path, ldrfile, scadfile)
+                    self.batch['translated'][name] = (
+                        self.settings['selfcontained'].getvalue(),
+                        self.deps[name], self.file_colors, signature)
+                finally:
+                    self.settings['selfcontained'] = output
             else:
-                scaddir = os.path.dirname(scadfile)
-                if scaddir:
-                    os.makedirs(os.path.dirname(scadfile), exist_ok=True)
-                with open(scadfile, 'w', encoding="utf-8") as fdw:
-                    fdw.write(result)
+                self.deps[name] = self.batch['translated'][name][1]
+                if self.used_colors is not None:
+                    self.used_colors.update(
+                        self.batch['translated'][name][2])
+                for file in self.deps[name]:
+                    self.enqueue(file, path)
+            self.settings['selfcontained'].write(
+                self.batch['translated'][name][0])
+        self.queue[1].clear()
+
+    def process_queue_pipelined(self, threads):
+        """ process enqueued files overlapping I/O and translation
+
+        Only valid when not creating self-contained files. Reader
+        threads prefetch the upcoming files in queue order and writer
+        threads write finished translations, while the files get
+        translated one after the other in this thread just as by
+        process_queue().
+        """
+        entries = []
+        while self.queue[0]:
+            entries.append(self.dequeue())
         self.queue[1].clear()
+        window = 4 * threads
+        upcoming = iter(entries)
+        with concurrent.futures.ThreadPoolExecutor(threads) as readers, \
+                concurrent.futures.ThreadPoolExecutor(threads) as writers:
+            reads = collections.deque(
+                (entry, readers.submit(self.read_file, entry[0], entry[2]))
+                for entry in itertools.islice(upcoming, window))
+            writes = collections.deque()
+            self.writer = lambda *args: writes.append(
+                writers.submit(self.write_output, *args))
+            try:
+                while reads:
+                    entry, lines = reads.popleft()
+                    for following in itertools.islice(upcoming, 1):
+                        reads.append((following, readers.submit(
+                            self.read_file, following[0], following[2])))
+                    self.write_file(*entry, lines=lines.result())
+                    # limit the translations waiting to be written
+                    while len(writes) > window:
+                        writes.popleft().result()
+                for write in writes:
+                    write.result()
+            finally:
+                self.writer = None
 
-    def convert_lib(self, self_contained=False):
-        """ Convert the whole library """
+    def process_queue_parallel(self, jobs):
+        """ process enqueued files in a pool of worker processes
+
+        Only valid when not creating self-contained files, as then
+        every file is written on its own and there is no shared state
+        between them.
+        """
+        entries = []
+        while self.queue[0]:
+            entries.append(self.dequeue())
+        self.queue[1].clear()
+        chunksize = max(1, len(entries) // (jobs * 8))
+        chunks = [entries[i:i+chunksize]
+                  for i in range(0, len(entries), chunksize)]
+        settings = dict(self.settings, selfcontained=None)
+        with multiprocessing.Pool(
+                jobs, _init_worker,
+                (settings, self.index, self.stats is not None)) as pool:
+            for deps, stats in pool.imap_unordered(_process_entries, chunks):
+                self.deps.update(deps)
+                if stats is not None:
+                    self.stats.merge(stats)
+
+    def file_deps(self, ldrfile):
+        """ Get the dependencies of a file without writing it. """
+        for _ in self.translate_lines(
+                self.part_cache.get(ldrfile, 'lines', list, self.files)):
+            pass
+        return sorted(self.get_deps())
+
+    def dependency_graph(self, models=()):
+        """ Build the dependency graph of the library
+
+        models are further files to include in the graph, which appear
+        in it by their file name.
+        """
+        self.full_index()
+        edges = {}
         for name in self.index:
-            self.enqueue(name)
-        libref = importlib_resources.files(__name__) / 'lib.scad'
+            edges[name] = self.file_deps(self.library_files(name)[0])
+        for model in models:
+            edges[model] = self.file_deps(model)
+        return DependencyGraph(edges)
+
+    def update_lib(self, jobs=1, incremental=False):
+        """ Translate the library files of a non self-contained library
+
+        A manifest of the translated files is written into the library.
+        With incremental set only files that changed since the manifest
+        was written get translated and output of files removed from the
+        library gets deleted. With bounds also the files using changed
+        files get translated again.
+        """
+        manifest = LibraryManifest(
+            os.path.join(self.settings['scadlibs'],
+                         self.settings['scadlibname'], 'manifest.json'),
+            self.settings, self.files)
+        if incremental:
+            manifest.load()
+        files = {}
+        stale = set()
+        for name in self.index:
+            files[name] = self.library_files(name)
+            if not manifest.is_current(name, *files[name], self.find_part):
+                stale.add(name)
+        # bounds include the geometry of all dependencies
+        if self.settings['bounds']:
+            stale = manifest.dependents(stale)
+        for name in self.index:
+            if name in stale:
+                self.enqueue(name)
+        self.deps = {}
+        if jobs > 1:
+            self.process_queue_parallel(jobs)
+        else:
+            self.process_queue()
+        for name, deps in self.deps.items():
+            manifest.record(name, *files[name],
+                            manifest.resolve(self.find_part, deps))
+        for scadfile in manifest.removed():
+            if os.path.exists(scadfile):
+                os.remove(scadfile)
+        manifest.save()
+
+    def convert_lib(self, self_contained=False, jobs=1, incremental=False):
+        """ Convert the whole library
+
+        With jobs > 1 the files of a non self-contained library are
+        translated by that many worker processes. See update_lib() for
+        incremental translation.
+        """
+        self.full_index()
         if self_contained:
+            for name in self.index:
+                self.enqueue(name)
             with open(os.path.join(self.settings['scadlibs'],
                                    self.settings['scadlibname']+'.scad'),
-                      'w', encoding="utf-8") as fdw:
-                self.settings['selfcontained'] = fdw
+                      'w', encoding="utf-8") as output:
+                fdw = self.settings['selfcontained'] = self.counted(output)
                 fdw.write(self.colorfile())
-                with importlib_resources.as_file(libref) as libpath:
-                    with open(libpath, encoding="utf-8") as filedata:
-                        lines = filedata.readlines()
-                fdw.write(''.join(lines))
+                fdw.write(self.lib_scad())
                 self.process_queue()
         else:
             os.makedirs(os.path.join(self.settings['scadlibs'],
                                      self.settings['scadlibname']),
                         exist_ok=True)
-            with importlib_resources.as_file(libref) as libpath:
-                with open(libpath, encoding="utf-8") as filedata:
-                    lines = filedata.readlines()
             with open(os.path.join(self.settings['scadlibs'],
                                    self.settings['scadlibname'], 'lib.scad'),
                       'w', encoding="utf-8") as fdw:
                 fdw.write('use <colors.scad>\n')
-                fdw.write(''.join(lines))
+                fdw.write(self.lib_scad())
             with open(os.path.join(self.settings['scadlibs'],
                                    self.settings['scadlibname'],
                                    'colors.scad'),
                       'w', encoding="utf-8") as fdw:
                 fdw.write(self.colorfile())
-            self.process_queue()
+            self.update_lib(jobs, incremental)
+
+    def compile_store(self, filename):
+        """ Compile the whole library into a binary part store. """
+        self.full_index()
+        writer = partstore.StoreWriter()
+        for name in sorted(self.index):
+            ldrfile = self.library_files(name)[0]
+            with self.files.open(ldrfile) as filedata:
+                writer.add(
+                    os.path.relpath(ldrfile, self.settings['library_root']),
+                    geometry.parse(filedata,
+                                   LDrawConverter.make_function_name),
+                    *self.files.stat(ldrfile))
+        writer.write(filename)
+
+    def open_store(self, filename):
+        """ Read library parts from a binary part store. """
+        if self.store is not None:
+            self.store.close()
+        self.store = partstore.PartStore(filename)
+
+    def load_part(self, name):
+        """ Parse a library file into sections of commands.
+
+        Parts get read from the part store if one is open and the part
+        did not change since the store got compiled.
+        """
+        ldrfile = self.library_files(name)[0]
+        if self.store is not None:
+            key = os.path.relpath(ldrfile, self.settings['library_root'])
+            if key in self.store.index:
+                if self.store.signature(key) == self.files.stat(ldrfile):
+                    return self.store.load(key)
+        return self.part_cache.get(
+            ldrfile, 'sections',
+            lambda filedata: geometry.parse(
+                filedata, LDrawConverter.make_function_name), self.files)
 
-    def convert_file(self, ldrfile, scadfile, self_contained=False):
-        """ Convert a single file """
+    def cache_stats(self):
+        """ Get hit and miss statistics of the part cache. """
+        return self.part_cache.stats()
+
+    def convert_file(self, ldrfile, scadfile, self_contained=False,
+                     flatten=False, instanced=False):
+        """ Convert a single file
+
+        With flatten set the file gets converted by convert_flat(),
+        with instanced set by convert_instanced().
+        """
+        if instanced or flatten:
+            with self.timer('flatten'):
+                if instanced:
+                    self.convert_instanced(ldrfile, scadfile, self_contained)
+                else:
+                    self.convert_flat(ldrfile, scadfile, self_contained)
+            return
         self.enqueue('__main__', '/', ldrfile, scadfile)
         if self_contained:
-            with open(scadfile, 'w', encoding="utf-8") as fdw:
-                self.settings['selfcontained'] = fdw
-                fdw.write(self.colorfile())
-                libref = importlib_resources.files(__name__) / 'lib.scad'
-                with importlib_resources.as_file(libref) as libpath:
-                    with open(libpath, encoding="utf-8") as filedata:
-                        lines = filedata.readlines()
-                fdw.write(''.join(lines))
-                fdw.write('makepoly(ldraw_lib____main__(), '
-                          f"line={self.settings['line']});\n")
+            with open(scadfile, 'w', encoding="utf-8") as output:
+                fdw = self.settings['selfcontained'] = self.counted(output)
+                if not self.settings['used_colors']:
+                    fdw.write(self.cached('colors', self.colorfile))
+                fdw.write(self.cached('lib', self.lib_scad))
+                if self.settings['steps']:
+                    fdw.write('ldraw_lib____main__('
+                              f"line={self.settings['line']});\n")
+                else:
+                    fdw.write('makepoly(ldraw_lib____main__(), '
+                              f"line={self.settings['line']});\n")
+                self.used_colors = set() \
+                    if self.settings['used_colors'] else None
                 self.process_queue()
+                if self.used_colors is not None:
+                    # the color functions may follow their use
+                    fdw.write('\n' + self.colorfile(self.used_colors))
+                    self.used_colors = None
         else:
             self.process_queue()
+
+    def convert_files(self, files, self_contained=False, flatten=False,
+                      instanced=False):
+        """ Convert several files in one batch
+
+        files is an iterable of (ldrfile, scadfile) pairs. The color
+        tables and the OpenSCAD library are read once for the whole
+        batch and with self_contained set every dependency is
+        translated only once and reused for all files.
+        """
+        self.batch = {'translated': {}}
+        try:
+            for ldrfile, scadfile in files:
+                self.convert_file(ldrfile, scadfile, self_contained,
+                                  flatten, instanced)
+        finally:
+            self.batch = None
@@ -0,0 +1,145 @@
+""" Access to the files of an LDraw library on disk or in a zip archive.
+
+The library can be an extracted tree or an archive like the complete.zip
+LDraw ships. Files of an archive are addressed by paths below the path
+of the archive, e.g. complete.zip/parts/3001.dat, so the rest of the
+converter handles both the same way.
+"""
+
+import io
+import os
+import time
+import zipfile
+import threading
+
+
+class DiskFiles:
+    """ Files of a library on disk """
+
+    def stat(self, path):
+        """ get (mtime_ns, size) of a file """
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def open(self, path):
+        """ open a file as text """
+        return open(path, encoding="utf-8", errors='replace')
+
+    def read_bytes(self, path):
+        """ read the content of a file """
+        with open(path, 'rb') as filedata:
+            return filedata.read()
+
+    def listdir(self, path):
+        """ list the entries of a directory """
+        return os.listdir(path)
+
+    def isfile(self, path):
+        """ check whether a file exists """
+        return os.path.isfile(path)
+
+
+class ZipFiles(DiskFiles):
+    """ Files of a library in a zip archive
+
+    The central directory is read once when the archive gets opened,
+    members are read on demand through the one open archive. Paths not
+    below the archive refer to files on disk.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.archive = zipfile.ZipFile(path)  # pylint: disable=R1732
+        self.lock = threading.Lock()
+        names = [info.filename for info in self.archive.infolist()]
+        # members are below the folder holding the color table, e.g. ldraw/
+        configs = [name for name in names
+                   if name.rpartition('/')[2].lower() == 'ldconfig.ldr']
+        self.prefix = min(configs, key=lambda name: name.count('/'),
+                          default='').rpartition('/')[0]
+        self.prefix += '/' if self.prefix else ''
+        self.members = {}
+        self.dirs = {'': set()}
+        for name in names:
+            if not name.startswith(self.prefix):
+                continue
+            relative = name[len(self.prefix):]
+            if relative.endswith('/'):
+                relative = relative.rstrip('/')
+                self.dirs.setdefault(relative, set())
+            else:
+                self.members[relative] = self.archive.getinfo(name)
+            # folders get listed even without entries of their own
+            while relative:
+                folder, _, base = relative.rpartition('/')
+                self.dirs.setdefault(folder, set()).add(base)
+                relative = folder
+
+    def member(self, path):
+        """ get the path of a member relative to the library, or None """
+        path = os.path.abspath(path)
+        if not path.startswith(self.path + os.sep):
+            return None
+        return os.path.relpath(path, self.path).replace(os.sep, '/')
+
+    def info(self, path):
+        """ get the information of a member """
+        try:
+            return self.members[self.member(path)]
+        except KeyError:
+            raise FileNotFoundError(path) from None
+
+    def stat(self, path):
+        if self.member(path) is None:
+            return super().stat(path)
+        info = self.info(path)
+        return (int(time.mktime(info.date_time + (0, 0, -1))) * 10**9,
+                info.file_size)
+
+    def read_bytes(self, path):
+        if self.member(path) is None:
+            return super().read_bytes(path)
+        info = self.info(path)
+        with self.lock:
+            return self.archive.read(info)
+
+    def open(self, path):
+        if self.member(path) is None:
+            return super().open(path)
+        return io.StringIO(self.read_bytes(path).decode('utf-8', 'replace'))
+
+    def listdir(self, path):
+        member = self.member(path)
+        if member is None:
+            if os.path.abspath(path) != self.path:
+                return super().listdir(path)
+            member = ''
+        try:
+            return sorted(self.dirs[member])
+        except KeyError:
+            raise FileNotFoundError(path) from None
+
+    def isfile(self, path):
+        if self.member(path) is None:
+            return super().isfile(path)
+        return self.member(path) in self.members
+
+
+# files on disk
+DISK = DiskFiles()
+
+# open archives shared by all converters of a process
+_ARCHIVES = {}
+_ARCHIVES_LOCK = threading.Lock()
+
+
+def open_library(root):
+    """ get the files of a library, opening an archive only once """
+    if not os.path.isfile(root) or not zipfile.is_zipfile(root):
+        return DISK
+    # an archive must not be shared with a forked process
+    key = (os.path.abspath(root), os.getpid())
+    with _ARCHIVES_LOCK:
+        if key not in _ARCHIVES:
+            _ARCHIVES[key] = ZipFiles(root)
+        return _ARCHIVES[key]
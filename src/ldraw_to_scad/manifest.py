@@ -0,0 +1,139 @@
+""" Track the sources a translated library was built from. """
+
+import os
+import json
+import hashlib
+
+from .libraryfs import DISK
+
+try:
+    from importlib import metadata
+except ImportError:  # Python < 3.8
+    metadata = None
+
+
+# settings that change the content of the translated files
+OUTPUT_SETTINGS = ['commented', 'line', 'scadlibname', 'bounds', 'lod',
+                   'simplify']
+
+
+def tool_version():
+    """ get the version of the installed converter """
+    if metadata is None:
+        return '0.0.0'
+    try:
+        return metadata.version('ldraw-to-scad')
+    except metadata.PackageNotFoundError:
+        return '0.0.0'
+
+
+def file_signature(filename, files=DISK):
+    """ get modification time, size and hash of a file """
+    mtime, size = files.stat(filename)
+    digest = hashlib.sha256(files.read_bytes(filename)).hexdigest()
+    return {'mtime': mtime, 'size': size, 'hash': digest}
+
+
+class LibraryManifest:
+    """ Manifest of a translated library
+
+    For each translated file it records the signature of the source,
+    the output file and how every dependency got resolved, so a later
+    translation can skip files that would not change.
+    """
+
+    def __init__(self, filename, settings, files=DISK):
+        self.filename = filename
+        self.library = files
+        self.header = {
+            'version': tool_version(),
+            'settings': {key: settings[key] for key in OUTPUT_SETTINGS}}
+        self.files = {}
+        self.old = {}
+
+    def load(self):
+        """ load a previous manifest if it matches the current setup """
+        try:
+            with open(self.filename, encoding="utf-8") as filedata:
+                data = json.load(filedata)
+        except (OSError, ValueError):
+            return
+        if all(data.get(key) == value for key, value in self.header.items()):
+            self.old = data.get('files', {})
+
+    def output_path(self, scadfile):
+        """ get the path of an output file relative to the manifest """
+        return os.path.relpath(scadfile, os.path.dirname(self.filename))
+
+    @staticmethod
+    def resolve(find_part, deps):
+        """ resolve dependencies to library locations """
+        result = {}
+        for dep in deps:
+            try:
+                result[dep] = list(find_part(dep))
+            except KeyError:
+                result[dep] = None
+        return result
+
+    def is_current(self, name, ldrfile, scadfile, find_part):
+        """ check whether a previous translation is still valid
+
+        A current entry is carried over into the new manifest.
+        """
+        old = self.old.get(name)
+        if old is None or old['output'] != self.output_path(scadfile) or \
+           not os.path.exists(scadfile):
+            return False
+        try:
+            stat = self.library.stat(ldrfile)
+        except OSError:
+            return False
+        source = old['source']
+        if stat != (source['mtime'], source['size']):
+            source = file_signature(ldrfile, self.library)
+            if source['hash'] != old['source']['hash']:
+                return False
+        if self.resolve(find_part, old['deps']) != old['deps']:
+            return False
+        self.files[name] = dict(old, source=source)
+        return True
+
+    def dependents(self, names):
+        """ get the names with all files that use them in the old manifest
+
+        This follows the references of the old translations transitively.
+        """
+        users = {}
+        for name, entry in self.old.items():
+            for dep in entry['deps']:
+                users.setdefault(dep, []).append(name)
+        result = set(names)
+        todo = list(result)
+        while todo:
+            for user in users.get(todo.pop(), []):
+                if user not in result:
+                    result.add(user)
+                    todo.append(user)
+        return result
+
+    def record(self, name, ldrfile, scadfile, deps):
+        """ record a freshly translated file """
+        self.files[name] = {
+            'source': file_signature(ldrfile, self.library),
+            'output': self.output_path(scadfile),
+            'deps': deps}
+
+    def removed(self):
+        """ get old output files no longer produced by any source """
+        current = {entry['output'] for entry in self.files.values()}
+        return sorted(os.path.join(os.path.dirname(self.filename),
+                                   entry['output'])
+                      for entry in self.old.values()
+                      if entry['output'] not in current)
+
+    def save(self):
+        """ write the manifest """
+        with open(self.filename, 'w', encoding="utf-8") as fdw:
+            json.dump(dict(self.header, files=self.files), fdw,
+                      indent=1, sort_keys=True)
@@ -0,0 +1,82 @@
+""" Assemble flattened geometry into polyhedra.
+
+solidpoly() in lib.scad merges all faces into one polyhedron by
+concatenating point and face lists face by face, which is quadratic in
+the number of faces. The functions here do the same merge in a single
+pass, so OpenSCAD only has to create the resulting polyhedra.
+"""
+
+
+class VertexWeld:
+    """ Merge points closer than a tolerance using a spatial hash
+
+    Points are hashed into cubic cells of the size of the tolerance, so
+    only the neighbouring cells have to be searched for a close point.
+    A tolerance of 0 merges exactly equal points only.
+    """
+
+    def __init__(self, tolerance):
+        self.tolerance = tolerance
+        self.cells = {}
+        self.points = []
+
+    def cell(self, point):
+        """ get the cell of a point """
+        if not self.tolerance:
+            return point
+        return tuple(int(value // self.tolerance) for value in point)
+
+    def index(self, point):
+        """ get the index of a point, adding it if there is no close one """
+        cell = self.cell(point)
+        if not self.tolerance:
+            neighbours = [cell]
+        else:
+            neighbours = [(cell[0] + i, cell[1] + j, cell[2] + k)
+                          for i in (-1, 0, 1) for j in (-1, 0, 1)
+                          for k in (-1, 0, 1)]
+        for neighbour in neighbours:
+            for index in self.cells.get(neighbour, ()):
+                if all(abs(a - b) <= self.tolerance
+                       for a, b in zip(self.points[index], point)):
+                    return index
+        self.cells.setdefault(cell, []).append(len(self.points))
+        self.points.append(point)
+        return len(self.points) - 1
+
+
+def face_indices(indices):
+    """ drop repeated points of a welded face, None if it degenerates """
+    face = [index for position, index in enumerate(indices)
+            if index != indices[position - 1]]
+    return face if len(set(face)) >= 3 else None
+
+
+def assemble(flat, tolerance=None):
+    """ merge the faces of flattened geometry into polyhedra
+
+    Returns a list of (color, step, points, faces) with one entry per
+    color and STEP in order of their first face. points is the list of
+    all points and faces a list of lists of point indices. With a
+    tolerance given close points get welded into one.
+    """
+    meshes = {}
+    for face, points, color, step in flat:
+        if not face:
+            continue
+        if (color, step) not in meshes:
+            meshes[color, step] = (
+                [] if tolerance is None else VertexWeld(tolerance), [])
+        vertices, faces = meshes[color, step]
+        if tolerance is None:
+            faces.append(list(range(len(vertices),
+                                    len(vertices) + len(points))))
+            vertices.extend(points)
+        else:
+            indices = face_indices([vertices.index(point)
+                                    for point in points])
+            if indices is not None:
+                faces.append(indices)
+    return [(color, step,
+             vertices if tolerance is None else vertices.points, faces)
+            for (color, step), (vertices, faces) in meshes.items()]
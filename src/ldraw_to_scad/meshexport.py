@@ -0,0 +1,260 @@
+""" Export flattened geometry as binary STL or 3MF meshes.
+
+The faces get the transformation of unitmatrix() in lib.scad, so the
+meshes match what OpenSCAD renders from the translated files. OpenSCAD
+expects the points of a face clockwise seen from the outside, STL and
+3MF counterclockwise, so every face gets reversed. Quadrilaterals are
+split into two triangles. Geometry flattened into NumPy arrays gets
+exported without going through elements one by one.
+"""
+
+import json
+import struct
+import zipfile
+
+from . import mesh
+from .arraygeometry import numpy, Geometry, REVERSE
+
+
+# size of a LDraw unit in mm, as the default of unit in lib.scad
+UNIT = 2 / 5
+
+# triangles collected before they get written
+CHUNK = 4096
+
+STL_TRIANGLE = struct.Struct('<12fH')
+
+# records of binary STL, the same layout as STL_TRIANGLE
+STL_RECORD = [('normal', '<f4', (3,)), ('points', '<f4', (3, 3)),
+              ('attributes', '<u2')]
+
+CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/'
+    'content-types">'
+    '<Default Extension="rels" ContentType="application/'
+    'vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="model" ContentType="application/'
+    'vnd.ms-package.3dmanufacturing-3dmodel+xml"/></Types>\n')
+
+RELATIONSHIPS = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/'
+    '2006/relationships">'
+    '<Relationship Target="/3D/3dmodel.model" Id="rel0" '
+    'Type="http://schemas.microsoft.com/3dmanufacturing/2013/01/'
+    '3dmodel"/></Relationships>\n')
+
+MODEL_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<model unit="millimeter" xml:lang="en-US" xmlns="http://'
+    'schemas.microsoft.com/3dmanufacturing/core/2015/02">\n<resources>\n')
+
+
+def to_mm(point, unit=UNIT):
+    """ transform a point like unitmatrix() in lib.scad """
+    return (unit * point[0], unit * point[2], -unit * point[1])
+
+
+def fan(face):
+    """ split a counterclockwise polygon into triangles """
+    return [(face[0], face[i], face[i + 1]) for i in range(1, len(face) - 1)]
+
+
+def normal(triangle):
+    """ get the unit normal of a counterclockwise triangle """
+    first, second, third = triangle
+    u = [second[i] - first[i] for i in range(3)]
+    v = [third[i] - first[i] for i in range(3)]
+    cross = (u[1] * v[2] - u[2] * v[1], u[2] * v[0] - u[0] * v[2],
+             u[0] * v[1] - u[1] * v[0])
+    length = sum(value * value for value in cross) ** 0.5 or 1.0
+    return tuple(value / length for value in cross)
+
+
+def triangles(flat, unit=UNIT):
+    """ get the faces of flattened geometry as triangles in mm
+
+    This is a generator yielding (color, triangle) with the points of
+    each triangle counterclockwise seen from the outside.
+    """
+    for face, points, color, _ in flat:
+        if face:
+            for triangle in fan([to_mm(point, unit)
+                                 for point in reversed(points)]):
+                yield color, triangle
+
+
+def array_triangles(geometry, unit=UNIT):
+    """ get the faces of flattened arrays as triangles in mm
+
+    Returns the colors and a (T, 3, 3) array of the triangles, in the
+    order triangles() yields them.
+    """
+    faces = geometry.faces
+    counts = geometry.counts[faces]
+    order = numpy.array(REVERSE)[counts][:, :, None]
+    points = numpy.take_along_axis(geometry.points[faces], order, axis=1)
+    points = unit * points[:, :, [0, 2, 1]] * [1, 1, -1]
+    split = numpy.stack([points[:, [0, 1, 2]], points[:, [0, 2, 3]]], axis=1)
+    keep = numpy.stack([numpy.ones(len(counts), dtype=bool), counts == 4],
+                       axis=1)
+    colors = geometry.colors[faces]
+    return numpy.stack([colors, colors], axis=1)[keep], split[keep]
+
+
+def array_normals(split):
+    """ get the unit normals of a (T, 3, 3) array of triangles """
+    normals = numpy.cross(split[:, 1] - split[:, 0], split[:, 2] - split[:, 0])
+    length = numpy.linalg.norm(normals, axis=1, keepdims=True)
+    return normals / numpy.where(length == 0, 1.0, length)
+
+
+def stl_chunks(flat, unit=UNIT):
+    """ get binary STL records in chunks of up to CHUNK triangles """
+    chunk = bytearray()
+    for _, triangle in triangles(flat, unit):
+        chunk += STL_TRIANGLE.pack(*normal(triangle), *triangle[0],
+                                   *triangle[1], *triangle[2], 0)
+        if len(chunk) == CHUNK * STL_TRIANGLE.size:
+            yield bytes(chunk)
+            chunk = bytearray()
+    if chunk:
+        yield bytes(chunk)
+
+
+def array_stl_chunks(geometry, unit=UNIT):
+    """ get binary STL records of flattened arrays in chunks """
+    for start in range(0, len(geometry.faces), CHUNK):
+        _, split = array_triangles(Geometry(
+            *(array[start:start + CHUNK] for array in geometry)), unit)
+        records = numpy.zeros(len(split), dtype=STL_RECORD)
+        records['normal'] = array_normals(split)
+        records['points'] = split
+        yield records.tobytes()
+
+
+def write_stl(filename, flat, unit=UNIT):
+    """ write flattened geometry as binary STL
+
+    flat is a list of elements or flattened arrays. Triangles are
+    written as they get produced, the count in the header gets filled
+    in at the end. Returns the number of triangles.
+    """
+    chunks = array_stl_chunks(flat, unit) \
+        if isinstance(flat, Geometry) else stl_chunks(flat, unit)
+    count = 0
+    with open(filename, 'wb') as fdw:
+        fdw.write(b'binary STL written by ldraw-to-scad'.ljust(80, b' '))
+        fdw.write(struct.pack('<I', 0))
+        for chunk in chunks:
+            fdw.write(chunk)
+            count += len(chunk) // STL_TRIANGLE.size
+        fdw.seek(80)
+        fdw.write(struct.pack('<I', count))
+    return count
+
+
+def material(colors, code):
+    """ get the display color of a color code, None if inherited """
+    if code in (16, 24):
+        return None
+    color = colors.get(-code - 1 if code < 0 else code)
+    if color is None:
+        return None
+    return json.loads(color)[1 if code < 0 else 0]
+
+
+def element_meshes(flat, unit=UNIT, tolerance=0):
+    """ get a mesh per color of elements
+
+    Returns a list of (color, points, triangles) with points in mm and
+    triangles indexing them counterclockwise.
+    """
+    return [(color, [to_mm(point, unit) for point in points],
+             [triangle for face in faces for triangle in fan(face[::-1])])
+            for color, _, points, faces in mesh.assemble(
+                [(face, points, color, 0) for face, points, color, _ in flat],
+                tolerance)]
+
+
+def array_meshes(geometry, unit=UNIT):
+    """ get a mesh per color of flattened arrays
+
+    Same as element_meshes() with points merged only if they are equal,
+    but with the points of each mesh in sorted order.
+    """
+    colors, split = array_triangles(geometry, unit)
+    _, first = numpy.unique(colors, return_index=True)
+    meshes = []
+    for color in colors[numpy.sort(first)].tolist():
+        points, indices = numpy.unique(
+            split[colors == color].reshape(-1, 3), axis=0,
+            return_inverse=True)
+        indices = indices.reshape(-1, 3)
+        # faces with merged corners have no area
+        indices = indices[(indices[:, 0] != indices[:, 1]) &
+                          (indices[:, 1] != indices[:, 2]) &
+                          (indices[:, 2] != indices[:, 0])]
+        meshes.append((color, points.tolist(), indices.tolist()))
+    return meshes
+
+
+def write_3mf(filename, flat, colors, unit=UNIT, tolerance=0):
+    """ write flattened geometry as 3MF
+
+    flat is a list of elements or flattened arrays. Every color becomes
+    an object with a material of its display color, colors is the color
+    table as read by colors.read_colors(). Points closer than tolerance
+    LDraw units get merged. Objects are written one after the other.
+    Returns the number of triangles.
+    """
+    meshes = array_meshes(flat, unit) \
+        if isinstance(flat, Geometry) and not tolerance \
+        else element_meshes(flat, unit, tolerance)
+    materials = {}
+    for color, _, _ in meshes:
+        display = material(colors, color)
+        if display is not None:
+            materials.setdefault(color, (len(materials), display))
+    count = 0
+    with zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', CONTENT_TYPES)
+        archive.writestr('_rels/.rels', RELATIONSHIPS)
+        with archive.open('3D/3dmodel.model', 'w') as model:
+            model.write(MODEL_HEADER.encode('utf-8'))
+            # the schema requires a base in every basematerials element
+            if materials:
+                model.write(('<basematerials id="1">' + ''.join(
+                    f'<base name="{code}" displaycolor="{display}"/>'
+                    for code, (_, display) in materials.items()) +
+                    '</basematerials>\n').encode('utf-8'))
+            for number, (color, points, split) in enumerate(meshes):
+                write_object(model, number + 2, points, split,
+                             materials.get(color))
+                count += len(split)
+            model.write(('</resources>\n<build>' + ''.join(
+                f'<item objectid="{number + 2}"/>'
+                for number in range(len(meshes))) +
+                '</build>\n</model>\n').encode('utf-8'))
+    return count
+
+
+def write_object(model, number, points, split, color):
+    """ write a mesh as 3MF object """
+    attributes = '' if color is None else \
+        f' pid="1" pindex="{color[0]}"'
+    model.write(f'<object id="{number}" type="model"{attributes}>'
+                '<mesh>\n<vertices>\n'.encode('utf-8'))
+    for start in range(0, len(points), CHUNK):
+        model.write(''.join(
+            # adding 0.0 writes -0.0 as 0
+            f'<vertex x="{x + 0.0:.6g}" y="{y + 0.0:.6g}" '
+            f'z="{z + 0.0:.6g}"/>\n'
+            for x, y, z in points[start:start + CHUNK]).encode('utf-8'))
+    model.write(b'</vertices>\n<triangles>\n')
+    for start in range(0, len(split), CHUNK):
+        model.write(''.join(
+            f'<triangle v1="{v1}" v2="{v2}" v3="{v3}"/>\n'
+            for v1, v2, v3 in split[start:start + CHUNK]).encode('utf-8'))
+    model.write(b'</triangles>\n</mesh></object>\n')
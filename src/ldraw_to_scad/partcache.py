@@ -0,0 +1,76 @@
+""" Process-wide cache of parsed library files. """
+
+import os
+import threading
+import collections
+
+from .libraryfs import DISK
+
+
+class PartCache:
+    """ Size-bounded LRU cache of data loaded from files
+
+    Entries are keyed by the kind of data and the path of the file and
+    are only valid as long as modification time and size of the file
+    stay the same. The cache is bounded by the total size of the cached
+    source files, files larger than max_file_bytes are never cached.
+    """
+
+    def __init__(self, max_bytes=64 << 20, max_file_bytes=1 << 20):
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self.lock = threading.Lock()
+
+    def get(self, filename, kind, load, files=DISK):
+        """ get data of a file
+
+        load(filedata) gets called with the opened file if the data is
+        not cached yet. files gives access to the file, which may be
+        part of a library archive.
+        """
+        version = files.stat(filename)
+        key = (kind, os.path.abspath(filename))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(key)
+                self.counters['hits'] += 1
+                return entry[1]
+            self.counters['misses'] += 1
+        with files.open(filename) as filedata:
+            value = load(filedata)
+        if version[1] <= self.max_file_bytes:
+            with self.lock:
+                self.discard(key)
+                self.entries[key] = (version, value)
+                self.size += version[1]
+                while self.size > self.max_bytes:
+                    self.discard(next(iter(self.entries)))
+                    self.counters['evictions'] += 1
+        return value
+
+    def discard(self, key):
+        """ remove an entry, the lock must be held """
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[0][1]
+
+    def clear(self):
+        """ remove all entries and reset the statistics """
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self.counters = dict.fromkeys(self.counters, 0)
+
+    def stats(self):
+        """ get hit and miss statistics """
+        with self.lock:
+            return dict(self.counters, entries=len(self.entries),
+                        bytes=self.size)
+
+
+# cache shared by all converters of the process
+PART_CACHE = PartCache()
@@ -0,0 +1,198 @@
+""" Compact binary store of parsed LDraw library files.
+
+The store holds the commands produced by geometry.parse() for every
+file of a library in a few flat arrays, so parts can be loaded without
+tokenizing their text again. The file is memory-mapped and all arrays
+are read in place, the commands of a part get decoded into the tuples
+of geometry.parse() when it is loaded. Only flattening reads parts from
+the store, the text translation reads the library files.
+
+Layout, all integers in native byte order, every block padded to a
+multiple of 8 bytes:
+    header:   MAGIC, byte order, then 6 uint64: number of strings, parts,
+              sections, commands and values and length of string data
+    strings:  uint64 offsets (number of strings + 1) and utf-8 data
+    parts:    int64 (name, first section, sections, mtime_ns, size)
+    sections: int64 (name, first command, commands)
+    commands: int8 kind, int32 color, int32 string reference, int64
+              first value, each as a separate array
+    values:   float64 coordinates and matrix entries
+Command kinds are the line types 1 to 5, STEP for STEP meta commands and
+BFC for BFC meta commands, the option being the string reference.
+"""
+
+import sys
+import mmap
+import array
+
+from .geometry import points
+
+
+MAGIC = b'LDSTORE1'
+STEP = 0
+BFC = -1
+# number of values of each command kind
+VALUES = {STEP: 0, BFC: 0, 1: 12, 2: 6, 3: 9, 4: 12, 5: 12}
+
+
+def pad(data):
+    """ pad bytes to a multiple of 8 """
+    return data + b'\0' * (-len(data) % 8)
+
+
+class StoreWriter:
+    """ Collect parsed files and write them as a store """
+
+    def __init__(self):
+        self.strings = {}
+        self.parts = array.array('q')
+        self.sections = array.array('q')
+        # one array per field of the commands
+        self.commands = {'kinds': array.array('b'),
+                         'colors': array.array('i'),
+                         'refs': array.array('i'),
+                         'offsets': array.array('q')}
+        self.values = array.array('d')
+
+    def string(self, value):
+        """ get the index of a string in the string table """
+        return self.strings.setdefault(value, len(self.strings))
+
+    def command(self, command):
+        """ append a single command """
+        fields = self.commands
+        fields['offsets'].append(len(self.values))
+        if command[0] == 0:
+            step = command[1] == 'STEP'
+            fields['kinds'].append(STEP if step else BFC)
+            fields['colors'].append(0)
+            fields['refs'].append(-1 if step else self.string(command[2]))
+            return
+        fields['kinds'].append(command[0])
+        fields['colors'].append(command[1])
+        if command[0] == 1:
+            fields['refs'].append(self.string(command[3]))
+            for row in command[2]:
+                self.values.extend(row)
+        else:
+            fields['refs'].append(-1)
+            for point in command[2]:
+                self.values.extend(point)
+
+    def add(self, name, sections, mtime_ns=0, size=0):
+        """ add the parsed sections of a file """
+        self.parts.extend((self.string(name), len(self.sections) // 3,
+                           len(sections), mtime_ns, size))
+        # the main section of an MPD file is also listed by its name
+        stored = {}
+        for section, commands in sections.items():
+            if id(commands) not in stored:
+                stored[id(commands)] = len(self.commands['kinds'])
+                for command in commands:
+                    self.command(command)
+            self.sections.extend((self.string(section), stored[id(commands)],
+                                  len(commands)))
+
+    def write(self, filename):
+        """ write the store """
+        data = [s.encode('utf-8') for s in self.strings]
+        string_offsets = array.array('Q', [0])
+        for item in data:
+            string_offsets.append(string_offsets[-1] + len(item))
+        header = array.array('Q', [
+            len(data), len(self.parts) // 5, len(self.sections) // 3,
+            len(self.commands['kinds']), len(self.values),
+            string_offsets[-1]])
+        with open(filename, 'wb') as fdw:
+            fdw.write(MAGIC + pad(sys.byteorder.encode('ascii')))
+            for block in [header, string_offsets, b''.join(data),
+                          self.parts, self.sections,
+                          *self.commands.values(), self.values]:
+                fdw.write(pad(bytes(block)))
+
+
+class PartStore:
+    """ Read parts from a memory-mapped store """
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as filedata:
+            self.map = mmap.mmap(filedata.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        self.view = view = memoryview(self.map)
+        if view[:8] != MAGIC or \
+           bytes(view[8:16]).rstrip(b'\0') != sys.byteorder.encode('ascii'):
+            raise ValueError(f'{filename} is not a compatible part store')
+        pos = 16
+        counts = view[pos:pos+48].cast('Q')
+        pos += 48
+        blocks = [('string_offsets', 'Q', counts[0] + 1),
+                  ('string_data', 'B', counts[5]),
+                  ('parts', 'q', counts[1] * 5),
+                  ('sections', 'q', counts[2] * 3),
+                  ('kinds', 'b', counts[3]),
+                  ('colors', 'i', counts[3]),
+                  ('refs', 'i', counts[3]),
+                  ('offsets', 'q', counts[3]),
+                  ('values', 'd', counts[4])]
+        self.arrays = {}
+        for name, fmt, count in blocks:
+            length = count * array.array(fmt).itemsize
+            self.arrays[name] = view[pos:pos+length].cast(fmt)
+            pos += length + (-length % 8)
+        self.strings = [None] * counts[0]
+        parts = self.arrays['parts']
+        self.index = {self.string(parts[i * 5]): i
+                      for i in range(counts[1])}
+
+    def string(self, index):
+        """ get an entry of the string table """
+        if self.strings[index] is None:
+            offsets = self.arrays['string_offsets']
+            self.strings[index] = bytes(
+                self.arrays['string_data'][offsets[index]:offsets[index+1]]
+            ).decode('utf-8')
+        return self.strings[index]
+
+    def command(self, index):
+        """ decode a single command """
+        kind = self.arrays['kinds'][index]
+        if kind == STEP:
+            return (0, 'STEP')
+        if kind == BFC:
+            return (0, 'BFC', self.string(self.arrays['refs'][index]))
+        first = self.arrays['offsets'][index]
+        values = self.arrays['values'][first:first+VALUES[kind]]
+        if kind == 1:
+            return (1, self.arrays['colors'][index],
+                    (tuple(values[0:4]), tuple(values[4:8]),
+                     tuple(values[8:12])),
+                    self.string(self.arrays['refs'][index]))
+        return (kind, self.arrays['colors'][index], points(values))
+
+    def signature(self, name):
+        """ get (mtime_ns, size) of the source of a stored file """
+        part = self.index[name] * 5
+        return tuple(self.arrays['parts'][part+3:part+5])
+
+    def load(self, name):
+        """ get the parsed sections of a stored file """
+        part = self.index[name] * 5
+        first, count = self.arrays['parts'][part+1:part+3]
+        sections = {}
+        commands = {}
+        sections_array = self.arrays['sections']
+        for section in range(first, first + count):
+            name, start, length = sections_array[section*3:section*3+3]
+            if (start, length) not in commands:
+                commands[start, length] = [
+                    self.command(index)
+                    for index in range(start, start + length)]
+            sections[self.string(name)] = commands[start, length]
+        return sections
+
+    def close(self):
+        """ release the memory map """
+        for view in self.arrays.values():
+            view.release()
+        self.view.release()
+        self.map.close()
@@ -0,0 +1,252 @@
+""" Long-running conversion service keeping the library warm.
+
+The service answers HTTP requests on localhost or on a Unix socket:
+
+    POST /convert?self_contained=1&line=0.2   LDraw model as body
+    GET /status
+
+A conversion returns the OpenSCAD text, or with output=PATH writes it
+to PATH and returns JSON naming the file. Output files can only be
+written if the service has an output root, PATH being relative to it.
+"""
+
+import os
+import json
+import time
+import stat
+import tempfile
+import threading
+import socketserver
+import urllib.parse
+import http.server
+
+from .ldrawconverter import LDrawConverter
+
+
+# settings a request may change, with the conversion of their values
+REQUEST_SETTINGS = {'line': float, 'commented': None, 'lod': str,
+                    'simplify': None, 'steps': None, 'bounds': None,
+                    'used_colors': None, 'mesh': None, 'weld': float}
+
+# options of a conversion, all of them flags
+REQUEST_OPTIONS = ['self_contained', 'flatten', 'instanced']
+
+
+def parse_flag(value):
+    """ parse a boolean request parameter """
+    if value.lower() in ('1', 'true', 'yes', 'on'):
+        return True
+    if value.lower() in ('0', 'false', 'no', 'off'):
+        return False
+    raise ValueError(f'invalid flag {value}')
+
+
+def parse_query(query):
+    """ get the keyword arguments of ConversionService.convert() """
+    result = {}
+    for key, value in urllib.parse.parse_qsl(query, keep_blank_values=True):
+        if key == 'output':
+            result[key] = value
+        elif key in REQUEST_OPTIONS:
+            result[key] = parse_flag(value)
+        elif key in REQUEST_SETTINGS:
+            result[key] = (REQUEST_SETTINGS[key] or parse_flag)(value)
+        else:
+            raise ValueError(f'unknown parameter {key}')
+    return result
+
+
+class ConversionService:
+    """ Convert models with a warm library index and shared caches
+
+    Every conversion gets a converter of its own, so conversions can
+    run concurrently in several threads. They share the library index,
+    the process-wide part cache, the color tables and the OpenSCAD
+    library, and for each combination of settings the translations of
+    library files into self-contained output. Translations of changed
+    library files are made again, but added or removed files, changed
+    color tables and bounds of changed subparts need a new service.
+    Requests may only write output files below output_root, none if it
+    is None.
+    """
+
+    def __init__(self, libdir, index_cache=True, settings=None,
+                 output_root=None):
+        self.output_root = output_root
+        self.template = LDrawConverter(libdir, index_cache=index_cache)
+        self.template.settings.update(settings or {})
+        self.template.batch = {}
+        self.warm = {key: self.template.cached(key, function) for key, function
+                     in [('color_tables', self.template.read_color_tables),
+                         ('colors', self.template.colorfile),
+                         ('lib', self.template.lib_scad)]}
+        self.translated = {}
+        self.lock = threading.Lock()
+        self.counters = {'conversions': 0, 'errors': 0, 'seconds': 0.0}
+
+    def converter(self, settings):
+        """ get a converter with the warm data for a job """
+        unknown = set(settings) - set(REQUEST_SETTINGS)
+        if unknown:
+            raise ValueError(f"unknown settings {', '.join(sorted(unknown))}")
+        converter = LDrawConverter(self.template.settings['library_root'],
+                                   self.template.index)
+        converter.settings.update(self.template.settings)
+        converter.settings.update(settings)
+        key = tuple(converter.settings[name] for name in REQUEST_SETTINGS)
+        with self.lock:
+            translated = self.translated.setdefault(key, {})
+        converter.batch = dict(self.warm, translated=translated)
+        return converter
+
+    def output_path(self, output):
+        """ get the file to write the output of a request to
+
+        Only relative paths staying below the output root are allowed.
+        """
+        if self.output_root is None:
+            raise ValueError('writing output files is disabled')
+        root = os.path.realpath(self.output_root)
+        if not output or os.path.isabs(output) or \
+                '..' in output.replace('\\', '/').split('/'):
+            raise ValueError(f'invalid output path {output}')
+        path = os.path.realpath(os.path.join(root, output))
+        if not path.startswith(root + os.sep):
+            raise ValueError(f'invalid output path {output}')
+        return path
+
+    def count(self, error, seconds):
+        """ count a finished conversion """
+        with self.lock:
+            self.counters['conversions'] += 1
+            self.counters['errors'] += error
+            self.counters['seconds'] += seconds
+
+    @staticmethod
+    def run(converter, model, output, options):
+        """ convert a model with a converter of a job """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            ldrfile = os.path.join(tmpdir, 'model.ldr')
+            with open(ldrfile, 'w', encoding="utf-8") as fdw:
+                fdw.write(model)
+            scadfile = output or os.path.join(tmpdir, 'model.scad')
+            converter.convert_file(ldrfile, scadfile, *options)
+            if output is not None:
+                return None
+            with open(scadfile, encoding="utf-8") as fdr:
+                return fdr.read()
+
+    def convert(self, model, output=None, self_contained=True,
+                flatten=False, instanced=False, **settings):
+        """ convert the text of an LDraw model
+
+        Returns the OpenSCAD text, or writes it to output if given,
+        relative to the output root. settings override those of the
+        service for this conversion.
+        """
+        # pylint: disable=too-many-arguments
+        start = time.perf_counter()
+        error = True
+        try:
+            if output is not None:
+                output = self.output_path(output)
+            result = self.run(self.converter(settings), model, output,
+                              (self_contained, flatten, instanced))
+            error = False
+            return result
+        finally:
+            self.count(error, time.perf_counter() - start)
+
+    def status(self):
+        """ get statistics of the service """
+        with self.lock:
+            return dict(self.counters, files=len(self.template.index),
+                        cache=self.template.cache_stats())
+
+
+class ConversionHandler(http.server.BaseHTTPRequestHandler):
+    """ Handle the requests to a conversion server """
+
+    def respond(self, code, body, content_type='application/json'):
+        """ send a response """
+        if not isinstance(body, str):
+            body = json.dumps(body)
+        data = body.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type + '; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """ report the status of the service """
+        if urllib.parse.urlsplit(self.path).path != '/status':
+            self.respond(404, {'error': 'not found'})
+            return
+        self.respond(200, self.server.service.status())
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """ convert the model in the request body """
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != '/convert':
+            self.respond(404, {'error': 'not found'})
+            return
+        model = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            options = parse_query(url.query)
+            result = self.server.service.convert(
+                model.decode('utf-8', errors='replace'), **options)
+        except KeyError as error:
+            self.respond(400, {'error': f'missing part {error}'})
+        except (ValueError, OSError) as error:
+            self.respond(400, {'error': str(error)})
+        except Exception as error:  # pylint: disable=broad-except
+            self.respond(500, {'error': f'{type(error).__name__}: {error}'})
+        else:
+            if result is None:
+                self.respond(200, {'output': options['output']})
+            else:
+                self.respond(200, result, 'text/plain')
+
+    def address_string(self):
+        """ name the client, which has no address on a Unix socket """
+        if isinstance(self.client_address, tuple):
+            return super().address_string()
+        return 'local'
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        """ log requests only if the server is verbose """
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class ConversionServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """ Serve conversions over HTTP, by default on localhost
+
+    This is http.server.ThreadingHTTPServer, which needs Python 3.7.
+    """
+    daemon_threads = True
+
+    def __init__(self, service, address=('127.0.0.1', 8765), verbose=False):
+        super().__init__(address, ConversionHandler)
+        self.service = service
+        self.verbose = verbose
+
+
+class UnixConversionServer(socketserver.ThreadingUnixStreamServer):
+    """ Serve conversions over HTTP on a Unix socket """
+    daemon_threads = True
+
+    def __init__(self, service, path, verbose=False):
+        # a socket left over by an earlier server gets replaced
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            os.remove(path)
+        super().__init__(path, ConversionHandler)
+        self.service = service
+        self.verbose = verbose
+
+    def server_close(self):
+        """ close the server and remove its socket """
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
@@ -0,0 +1,178 @@
+""" Timing and counting instrumentation of conversions. """
+
+import json
+import time
+import heapq
+import threading
+import contextlib
+
+
+# phases of a conversion in order of reporting
+PHASES = ['index', 'colors', 'read', 'translate', 'bounds', 'flatten',
+          'write']
+
+# line types counted while translating
+LINE_TYPES = ['0', '1', '2', '3', '4', '5']
+
+# counters of the part cache included in the statistics
+CACHE_COUNTERS = ['hits', 'misses', 'evictions']
+
+
+class ConversionStats:
+    """ Timers and counters collected while converting
+
+    Timers are exclusive: while a phase is timed inside another one,
+    the time only counts for the inner phase. Times of phases running
+    in several threads are summed over the threads. Part cache hits and
+    misses are counted from the creation of the statistics on.
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, cache=None, slowest=10):
+        self.cache = cache
+        # part cache counters at the start, minus those merged in
+        self.cache_base = dict.fromkeys(CACHE_COUNTERS, 0)
+        if cache is not None:
+            self.cache_base.update(
+                (key, cache.stats()[key]) for key in CACHE_COUNTERS)
+        self.slowest_count = slowest
+        self.times = dict.fromkeys(PHASES, 0.0)
+        self.counters = {'files': 0, 'source_bytes': 0, 'bytes_written': 0}
+        self.lines = dict.fromkeys(LINE_TYPES, 0)
+        self.slowest = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def add_time(self, phase, seconds):
+        """ add time spent in a phase """
+        with self.lock:
+            self.times[phase] = self.times.get(phase, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def timer(self, phase):
+        """ time a phase, pausing the timer of the enclosing phase """
+        stack = self.local.__dict__.setdefault('stack', [])
+        now = time.perf_counter()
+        if stack:
+            self.add_time(stack[-1][0], now - stack[-1][1])
+        stack.append([phase, now])
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self.add_time(phase, now - stack.pop()[1])
+            if stack:
+                stack[-1][1] = now
+
+    def count(self, counter, value=1):
+        """ increase a counter """
+        with self.lock:
+            self.counters[counter] += value
+
+    def count_lines(self, lines):
+        """ pass lines through counting them by type """
+        counts = self.lines
+        for line in lines:
+            params = line.split(maxsplit=1)
+            if params and params[0] in counts:
+                counts[params[0]] += 1
+            yield line
+
+    def rank(self, name, seconds):
+        """ keep a file if it is among the slowest, the lock must be held """
+        if len(self.slowest) < self.slowest_count:
+            heapq.heappush(self.slowest, (seconds, name))
+        elif self.slowest and seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (seconds, name))
+
+    def file_done(self, name, seconds):
+        """ record the translation time of a file """
+        with self.lock:
+            self.counters['files'] += 1
+            self.rank(name, seconds)
+
+    def cache_stats(self):
+        """ get the part cache statistics since the start """
+        current = self.cache.stats() if self.cache is not None else {}
+        return {key: current.get(key, 0) - base
+                for key, base in self.cache_base.items()}
+
+    def to_dict(self):
+        """ get the statistics as JSON compatible data """
+        with self.lock:
+            return {'times': dict(self.times),
+                    'counters': dict(self.counters),
+                    'lines': dict(self.lines),
+                    'cache': self.cache_stats(),
+                    'slowest': [{'file': name, 'seconds': seconds}
+                                for seconds, name in
+                                sorted(self.slowest, reverse=True)]}
+
+    def merge(self, data):
+        """ add statistics collected elsewhere, e.g. by a worker process """
+        for phase, seconds in data['times'].items():
+            self.add_time(phase, seconds)
+        with self.lock:
+            for key, value in data['counters'].items():
+                self.counters[key] += value
+            for key, value in data['lines'].items():
+                self.lines[key] += value
+            for key in CACHE_COUNTERS:
+                self.cache_base[key] -= data['cache'][key]
+            for entry in data['slowest']:
+                self.rank(entry['file'], entry['seconds'])
+
+    def report(self):
+        """ get the statistics as human readable text """
+        data = self.to_dict()
+        result = ['Phase       Seconds']
+        result.extend(f'{phase:10} {seconds:8.3f}'
+                      for phase, seconds in data['times'].items())
+        result.append(f'{"total":10} {sum(data["times"].values()):8.3f}')
+        counters = data['counters']
+        result.append(f"Files: {counters['files']}, "
+                      f"source bytes: {counters['source_bytes']}, "
+                      f"bytes written: {counters['bytes_written']}")
+        result.append('Lines: ' + ', '.join(
+            f'type {kind}: {count}' for kind, count in data['lines'].items()))
+        result.append(f"Part cache: {data['cache']['hits']} hits, "
+                      f"{data['cache']['misses']} misses")
+        if data['slowest']:
+            result.append('Slowest files:')
+            result.extend(f"{entry['seconds']:8.3f} {entry['file']}"
+                          for entry in data['slowest'])
+        return '\n'.join(result)
+
+    def save(self, filename):
+        """ write the statistics as JSON """
+        with open(filename, 'w', encoding="utf-8") as fdw:
+            json.dump(self.to_dict(), fdw, indent=1)
+
+
+class CountingWriter:
+    """ Forward writes to a file, timing and counting them """
+
+    def __init__(self, fdw, stats):
+        self.fdw = fdw
+        self.stats = stats
+
+    def write(self, text):
+        """ write text to the file """
+        with self.stats.timer('write'):
+            self.fdw.write(text)
+        self.stats.count('bytes_written', len(text.encode('utf-8')))
+
+    def writelines(self, lines):
+        """ write several lines to the file """
+        for line in lines:
+            self.write(line)
+
+
+class NoTimer:
+    """ Context manager doing nothing, used while statistics are off """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
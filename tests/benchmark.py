@@ -0,0 +1,207 @@
+""" benchmark suite timing conversions of a synthetic library
+
+Run with e.g.
+
+    python -m tests.benchmark --parts 500 --output results.json
+    python -m tests.benchmark --parts 500 --compare results.json
+
+to measure the main entry points of the converter and compare the
+results with those of an earlier run.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import contextlib
+import importlib.util
+import importlib.machinery
+
+from ldraw_to_scad import LDrawConverter
+from ldraw_to_scad.partcache import PART_CACHE
+
+from .synthetic import PARAMETERS, make_synthetic_library, \
+    make_synthetic_models, synthetic_part
+
+
+# entries of the work queue benchmark
+QUEUE_ENTRIES = 50000
+
+# lines of the part of the line translation benchmark
+PART_LINES = 200000
+
+
+def load_script():
+    """ load the ldraw2scad script as a module """
+    path = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), 'ldraw2scad')
+    loader = importlib.machinery.SourceFileLoader('ldraw2scad', path)
+    module = importlib.util.module_from_spec(
+        importlib.util.spec_from_loader('ldraw2scad', loader))
+    loader.exec_module(module)
+    return module
+
+
+def converter_for(workdir, output):
+    """ create a converter of the synthetic library writing to output """
+    converter = LDrawConverter(os.path.join(workdir, 'ldraw'),
+                               index_cache=False)
+    converter.set('scadlibs', output)
+    return converter
+
+
+def bench_index_library(workdir, _):
+    """ index the library """
+    LDrawConverter(os.path.join(workdir, 'ldraw'), index_cache=False)
+
+
+def bench_convert_file(workdir, output):
+    """ translate the first model """
+    os.makedirs(output)
+    converter_for(workdir, output).convert_file(
+        os.path.join(workdir, 'models', 'model0.mpd'),
+        os.path.join(output, 'model0.scad'))
+
+
+def bench_convert_file_self_contained(workdir, output):
+    """ translate the first model into a self-contained file """
+    os.makedirs(output)
+    converter_for(workdir, output).convert_file(
+        os.path.join(workdir, 'models', 'model0.mpd'),
+        os.path.join(output, 'model0.scad'), self_contained=True)
+
+
+def bench_convert_lib(workdir, output):
+    """ translate the library into a file per part """
+    converter_for(workdir, output).convert_lib()
+
+
+def bench_convert_lib_self_contained(workdir, output):
+    """ translate the library into a single file """
+    os.makedirs(output)
+    converter_for(workdir, output).convert_lib(self_contained=True)
+
+
+def bench_translate_dir(workdir, output):
+    """ translate all models as ldraw2scad does for a directory """
+    script = load_script()
+    with contextlib.redirect_stdout(io.StringIO()):
+        script.translate_dir(converter_for(workdir, output),
+                             os.path.join(workdir, 'models'), output)
+
+
+def bench_work_queue(workdir, output):
+    """ enqueue and drain a synthetic index in random order """
+    converter = converter_for(workdir, output)
+    names = [f'{i}.dat' for i in range(QUEUE_ENTRIES)]
+    random.Random(42).shuffle(names)
+    for name in names:
+        converter.enqueue(name, 'parts', name, name + '.scad')
+    while converter.queue[0]:
+        converter.dequeue()
+
+
+def bench_translate_lines(workdir, output):
+    """ translate a large synthetic part without any I/O """
+    for _ in converter_for(workdir, output).translate_lines(
+            synthetic_part(PART_LINES)):
+        pass
+
+
+BENCHMARKS = {
+    'index_library': bench_index_library,
+    'convert_file': bench_convert_file,
+    'convert_file_self_contained': bench_convert_file_self_contained,
+    'convert_lib': bench_convert_lib,
+    'convert_lib_self_contained': bench_convert_lib_self_contained,
+    'translate_dir': bench_translate_dir,
+    'work_queue': bench_work_queue,
+    'translate_lines': bench_translate_lines,
+}
+
+
+def make_workdir(workdir, parameters):
+    """ generate the synthetic library and models in workdir """
+    make_synthetic_library(os.path.join(workdir, 'ldraw'), **parameters)
+    make_synthetic_models(os.path.join(workdir, 'models'), **parameters)
+
+
+def run_benchmarks(parameters=None, repeat=3, names=None):
+    """ run the benchmarks and get their results as JSON compatible data
+
+    Every benchmark runs repeat times with an empty part cache and a
+    fresh output directory, the best time is the one to compare.
+    """
+    parameters = dict(PARAMETERS, **(parameters or {}))
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        make_workdir(workdir, parameters)
+        for name in names or BENCHMARKS:
+            runs = []
+            for run in range(repeat):
+                PART_CACHE.clear()
+                start = time.perf_counter()
+                BENCHMARKS[name](workdir,
+                                 os.path.join(workdir, f'{name}-{run}'))
+                runs.append(time.perf_counter() - start)
+            results[name] = {'best': min(runs),
+                             'mean': sum(runs) / len(runs), 'runs': runs}
+    return {'environment': {'python': platform.python_version(),
+                            'implementation':
+                            platform.python_implementation(),
+                            'machine': platform.machine(),
+                            'system': platform.system()},
+            'parameters': parameters, 'benchmarks': results}
+
+
+def compare(baseline, results):
+    """ get a table comparing the best times of two runs """
+    lines = [f"{'benchmark':30} {'baseline':>10} {'current':>10} "
+             f"{'ratio':>7}"]
+    for name, result in results['benchmarks'].items():
+        if name not in baseline['benchmarks']:
+            continue
+        before = baseline['benchmarks'][name]['best']
+        lines.append(f"{name:30} {before:10.4f} {result['best']:10.4f} "
+                     f"{result['best'] / before:7.2f}")
+    if baseline['parameters'] != results['parameters']:
+        lines.append('Warning: the runs used different parameters')
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    """ Main function """
+    parser = argparse.ArgumentParser(
+        description='Benchmark the converter on a synthetic library')
+    for key, value in PARAMETERS.items():
+        parser.add_argument(f'--{key}', type=int, default=value)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of runs of every benchmark')
+    parser.add_argument('--benchmark', action='append',
+                        choices=list(BENCHMARKS),
+                        help='benchmark to run, default all')
+    parser.add_argument('--output', metavar='RESULTS_FILE',
+                        help='write the results as JSON')
+    parser.add_argument('--compare', metavar='RESULTS_FILE',
+                        help='compare with the results of an earlier run')
+    args = parser.parse_args(argv)
+    results = run_benchmarks({key: getattr(args, key) for key in PARAMETERS},
+                             args.repeat, args.benchmark)
+    if args.output:
+        with open(args.output, 'w', encoding="utf-8") as fdw:
+            json.dump(results, fdw, indent=1)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fdr:
+            print(compare(json.load(fdr), results))
+    else:
+        json.dump(results, sys.stdout, indent=1)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+""" a small LDraw library for tests """
+
+import os
+
+
+LIBRARY = {
+    'LDConfig.ldr': ("0 !COLOUR Black CODE 0 VALUE #1B2A34 EDGE #2B4354\n"
+                     "0 !COLOUR Red CODE 4 VALUE #B40000 EDGE #333333\n"),
+    'LDCfgalt.ldr': ("0 !COLOUR Black CODE 0 VALUE #1B2A34 EDGE #808080\n"
+                     "0 !COLOUR Red CODE 4 VALUE #B40000 EDGE #000000\n"),
+    os.path.join('parts', '3001.dat'): (
+        "0 Brick 2 x 4\n"
+        "0 BFC CERTIFY CCW\n"
+        "1 16 0 0 0 1 0 0 0 1 0 0 0 1 s\\3001s01.dat\n"
+        "1 16 10 0 10 1 0 0 0 1 0 0 0 1 stud.dat\n"),
+    os.path.join('parts', 's', '3001s01.dat'): (
+        "0 ~Brick 2 x 4 without Studs\n"
+        "4 16 40 24 20 -40 24 20 -40 0 20 40 0 20\n"
+        "2 24 40 24 20 -40 24 20\n"),
+    os.path.join('p', 'stud.dat'): (
+        "0 Stud\n"
+        "1 16 0 0 0 6 0 0 0 -4 0 0 0 6 4-4cyli.dat\n"),
+    os.path.join('p', '4-4cyli.dat'): (
+        "0 Cylinder 1.0\n"
+        "4 16 1 1 0 0.9239 1 0.3827 0.9239 0 0.3827 1 0 0\n"
+        "5 24 1 0 0 1 1 0 0.9239 0 0.3827 0.9239 0 -0.3827\n"),
+    os.path.join('p', '48', '4-4cyli.dat'): (
+        "0 Hi-Res Cylinder 1.0\n"
+        "4 16 1 1 0 0.9914 1 0.1305 0.9914 0 0.1305 1 0 0\n"),
+    os.path.join('p', '8', '4-4cyli.dat'): (
+        "0 Lo-Res Cylinder 1.0\n"
+        "4 16 1 1 0 0.7071 1 0.7071 0.7071 0 0.7071 1 0 0\n"),
+}
+
+
+def make_library(root):
+    """ write a small LDraw library below root """
+    for sub_path in ['models', 'parts', 'p', os.path.join('parts', 's'),
+                     os.path.join('p', '48'), os.path.join('p', '8')]:
+        os.makedirs(os.path.join(root, sub_path), exist_ok=True)
+    for name, content in LIBRARY.items():
+        with open(os.path.join(root, name), 'w', encoding="utf-8") as fdw:
+            fdw.write(content)
+    return root
+
+
+def read_tree(root):
+    """ read all files below root into a dictionary """
+    result = {}
+    for fdir, _, files in os.walk(root):
+        for file in files:
+            path = os.path.join(fdir, file)
+            with open(path, 'rb') as fdr:
+                result[os.path.relpath(path, root)] = fdr.read()
+    return result
@@ -0,0 +1,155 @@
+""" a generator of synthetic LDraw libraries and models of any size """
+
+import os
+import random
+
+
+COLORS = 32
+
+# default size of a generated library and its models
+PARAMETERS = {'parts': 500, 'depth': 2, 'fanout': 8, 'primitives': 20,
+              'models': 4, 'submodels': 5, 'size': 50, 'seed': 42}
+
+
+def color_table(edge):
+    """ generate the lines of a color table """
+    return ''.join(f"0 !COLOUR Color_{code} CODE {code} "
+                   f"VALUE #{code * 0x70503:06X} EDGE #{edge:06X}\n"
+                   for code in range(COLORS))
+
+
+def matrix(rng):
+    """ generate the position and matrix of a type 1 line """
+    offset = ' '.join(str(rng.randint(-200, 200)) for _ in range(3))
+    scale = rng.choice([1, 1, 1, 2, -1])
+    return f"{offset} {scale} 0 0 0 1 0 0 0 1"
+
+
+def point(rng):
+    """ generate a random point """
+    return ' '.join(f'{rng.uniform(-10, 10):.4f}' for _ in range(3))
+
+
+def primitive(rng, fanout):
+    """ generate a primitive of fanout faces with their edges """
+    lines = ["0 Synthetic primitive\n", "0 BFC CERTIFY CCW\n"]
+    for _ in range(fanout):
+        if rng.random() < 0.5:
+            lines.append(f"3 16 {point(rng)} {point(rng)} {point(rng)}\n")
+        else:
+            lines.append(f"4 16 {point(rng)} {point(rng)} {point(rng)} "
+                         f"{point(rng)}\n")
+        lines.append(f"2 24 {point(rng)} {point(rng)}\n")
+        lines.append(f"5 24 {point(rng)} {point(rng)} {point(rng)} "
+                     f"{point(rng)}\n")
+    return ''.join(lines)
+
+
+def subfile(rng, title, children, fanout, primitives):
+    """ generate a part or subpart referencing children and primitives """
+    lines = [f"0 {title}\n", "0 BFC CERTIFY CCW\n"]
+    for child in children:
+        lines.append(f"1 16 {matrix(rng)} {child}\n")
+    for _ in range(fanout):
+        if rng.random() < 0.1:
+            lines.append("0 BFC INVERTNEXT\n")
+        lines.append(f"1 16 {matrix(rng)} "
+                     f"prim{rng.randrange(primitives)}.dat\n")
+    return ''.join(lines)
+
+
+def synthetic_part(count, seed=42):
+    """ generate the lines of a large part file """
+    rng = random.Random(seed)
+    templates = [
+        "0 // comment {}",
+        "0 BFC INVERTNEXT",
+        "1 16 {} 0 0 1 0 0 0 1 0 0 0 1 s\\part{}.dat",
+        "1 0x2FF0000 {} 0 0 1 0 0 0 1 0 0 0 1 p/4-4edge{}.dat",
+        "2 24 {} 0 0 1 1 1",
+        "3 16 {} 0 0 0 1 0 1 0 {}",
+        "4 16 {} 1 0 0.9239 1 0.3827 0.9239 0 0.3827 1 0 {}",
+        "5 24 {} 0 0 1 1 0 0.9239 0 0.3827 0.9239 0 {}",
+    ]
+    return [rng.choice(templates).format(i, i % 100) + '\n'
+            for i in range(count)]
+
+
+def write(root, name, content):
+    """ write a file of a generated tree """
+    with open(os.path.join(root, name), 'w', encoding="utf-8") as fdw:
+        fdw.write(content)
+
+
+def make_synthetic_library(root, **parameters):
+    """ write a synthetic LDraw library below root
+
+    Every one of parts parts references a chain of depth subparts,
+    every part and subpart references fanout primitives and every one of
+    primitives primitives has fanout faces, edges and conditional lines.
+    Primitives come in all three resolutions. Parameters not given are
+    taken from PARAMETERS. Returns root.
+    """
+    parameters = dict(PARAMETERS, **parameters)
+    depth, fanout, primitives = (parameters['depth'], parameters['fanout'],
+                                 parameters['primitives'])
+    rng = random.Random(parameters['seed'])
+    for sub_path in ['models', 'parts', 'p', os.path.join('parts', 's'),
+                     os.path.join('p', '48'), os.path.join('p', '8')]:
+        os.makedirs(os.path.join(root, sub_path), exist_ok=True)
+    write(root, 'LDConfig.ldr', color_table(0x333333))
+    write(root, 'LDCfgalt.ldr', color_table(0x000000))
+    for number in range(primitives):
+        for sub_path in ['p', os.path.join('p', '48'),
+                         os.path.join('p', '8')]:
+            write(os.path.join(root, sub_path), f'prim{number}.dat',
+                  primitive(rng, fanout))
+    for number in range(parameters['parts']):
+        for level in range(depth, 0, -1):
+            children = [f's\\part{number}s{level + 1}.dat'] \
+                if level < depth else []
+            write(os.path.join(root, 'parts', 's'),
+                  f'part{number}s{level}.dat',
+                  subfile(rng, f'~Part {number} level {level}', children,
+                          fanout, primitives))
+        write(os.path.join(root, 'parts'), f'part{number}.dat',
+              subfile(rng, f'Part {number}',
+                      [f's\\part{number}s1.dat'] if depth else [],
+                      fanout, primitives))
+    return root
+
+
+def mpd_model(rng, parts, submodels, size):
+    """ generate an MPD model of submodels with size parts each """
+    lines = ["0 FILE main.ldr\n", "0 Synthetic model\n"]
+    for number in range(submodels):
+        lines.append(f"1 {rng.randrange(COLORS)} {matrix(rng)} "
+                     f"sub{number}.ldr\n")
+        lines.append("0 STEP\n")
+    for number in range(submodels):
+        lines.append(f"0 FILE sub{number}.ldr\n")
+        for position in range(size):
+            lines.append(f"1 {rng.randrange(COLORS)} {matrix(rng)} "
+                         f"part{rng.randrange(parts)}.dat\n")
+            if position % 10 == 9:
+                lines.append("0 STEP\n")
+    return ''.join(lines)
+
+
+def make_synthetic_models(root, **parameters):
+    """ write synthetic MPD models below root
+
+    Writes models models of submodels submodels with size parts each,
+    using the parts of a synthetic library of the same parameters.
+    Returns the list of written files.
+    """
+    parameters = dict(PARAMETERS, **parameters)
+    rng = random.Random(parameters['seed'])
+    os.makedirs(root, exist_ok=True)
+    result = []
+    for number in range(parameters['models']):
+        write(root, f'model{number}.mpd',
+              mpd_model(rng, parameters['parts'], parameters['submodels'],
+                        parameters['size']))
+        result.append(os.path.join(root, f'model{number}.mpd'))
+    return result
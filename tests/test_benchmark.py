@@ -0,0 +1,94 @@
+""" regression benchmarks for ldraw_to_scad """
+
+from unittest import TestCase
+import json
+import random
+import tempfile
+import mock
+
+from ldraw_to_scad import LDrawConverter
+
+from . import benchmark
+from .synthetic import make_synthetic_library, synthetic_part
+
+
+def listdir_mock(_):
+    """ mock the listdir function with an empty library """
+    return []
+
+
+class TestWorkQueue(TestCase):
+    """ tests for the work queue on a synthetic index
+
+    The work_queue benchmark of tests/benchmark.py times this at scale.
+    """
+    ENTRIES = 5000
+
+    def test_queue_should_drain_in_order(self):
+        """ enqueue and drain a synthetic index in random order """
+        # setup
+        with mock.patch("os.listdir", listdir_mock):
+            converter = LDrawConverter()
+        names = [f'{i}.dat' for i in range(self.ENTRIES)]
+        random.Random(42).shuffle(names)
+        # test
+        for name in names:
+            converter.enqueue(name, 'parts', name, name + '.scad')
+        order = []
+        while converter.queue[0]:
+            order.append(converter.dequeue()[0])
+        # assert
+        self.assertEqual(order, sorted(names))
+
+
+class TestTranslateLines(TestCase):
+    """ tests for line translation of a large synthetic part
+
+    The translate_lines benchmark of tests/benchmark.py times this at
+    scale.
+    """
+    LINES = 20000
+
+    def test_it_should_translate_every_line(self):
+        """ translate a synthetic part without any I/O """
+        # setup
+        with mock.patch("os.listdir", listdir_mock):
+            converter = LDrawConverter()
+        lines = synthetic_part(self.LINES)
+        # test
+        count = sum(1 for _ in converter.translate_lines(lines))
+        # assert
+        self.assertGreater(count, self.LINES)
+
+
+class TestBenchmarkSuite(TestCase):
+    """ tests for the synthetic library and the benchmark suite """
+
+    def test_synthetic_library_should_be_indexed(self):
+        """ test the layout of a generated library """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            libdir = make_synthetic_library(tmpdir, parts=5, depth=3,
+                                            primitives=4)
+            converter = LDrawConverter(libdir, index_cache=False)
+            deps = converter.file_deps(converter.library_files('part0.dat')[0])
+        self.assertEqual(len(converter.index), 5 * 4 + 3 * 4)
+        self.assertIn('s\\part4s3.dat', converter.index)
+        self.assertIn('48\\prim3.dat', converter.index)
+        self.assertIn('s\\part0s1.dat', deps)
+
+    def test_suite_should_report_all_benchmarks(self):
+        """ run the suite on a tiny library """
+        parameters = {'parts': 4, 'models': 2, 'submodels': 2, 'size': 3}
+        with mock.patch.object(benchmark, 'QUEUE_ENTRIES', 100), \
+                mock.patch.object(benchmark, 'PART_LINES', 100):
+            results = json.loads(json.dumps(
+                benchmark.run_benchmarks(parameters, repeat=2)))
+        self.assertEqual(list(results['benchmarks']),
+                         list(benchmark.BENCHMARKS))
+        self.assertEqual(results['parameters']['parts'], 4)
+        for result in results['benchmarks'].values():
+            self.assertEqual(len(result['runs']), 2)
+            self.assertEqual(result['best'], min(result['runs']))
+        table = benchmark.compare(results, results).splitlines()
+        self.assertEqual(len(table), len(benchmark.BENCHMARKS) + 1)
+        self.assertTrue(table[1].endswith('1.00'))
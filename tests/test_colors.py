@@ -0,0 +1,79 @@
+""" test cases for the translation of color tables """
+
+from unittest import TestCase
+import os
+import tempfile
+
+from ldraw_to_scad import LDrawConverter
+from ldraw_to_scad.colors import read_colors, lookup_codes, color_table
+
+from .library import make_library
+
+
+class TestColorTable(TestCase):
+    """ tests for color lookup tables """
+    TABLE = ["0 !COLOUR Black CODE 0 VALUE #1B2A34 EDGE #2B4354\n",
+             "0 !COLOUR Red CODE 4 VALUE #B40000 EDGE #333333\n",
+             "0 !COLOUR Again CODE 4 VALUE #FFFFFF EDGE #FFFFFF\n",
+             "0 !COLOUR Glass CODE 1002 VALUE #123456 EDGE #654321 "
+             "ALPHA 128\n"]
+
+    def test_it_should_read_first_definitions(self):
+        """ test reading a color table """
+        self.assertEqual(read_colors(self.TABLE), {
+            0: '["#1B2A34FF","#2B4354"]', 4: '["#B40000FF","#333333"]',
+            1002: '["#12345680","#654321"]'})
+
+    def test_it_should_split_dense_and_sparse_codes(self):
+        """ test the vector indexed by code and the searched table """
+        result = color_table('LDConfig', read_colors(self.TABLE))
+        self.assertIn('ldraw_colors_LDConfig = [\n'
+                      ' ["#1B2A34FF","#2B4354"],\n'
+                      ' undef,\n undef,\n undef,\n'
+                      ' ["#B40000FF","#333333"]];\n', result)
+        self.assertIn('ldraw_colors_LDConfig_sparse = [\n'
+                      ' [1002, ["#12345680","#654321"]]];\n', result)
+        self.assertIn('search(id, ldraw_colors_LDConfig_sparse)', result)
+
+    def test_it_should_only_include_used_codes(self):
+        """ test restricting the table to the codes of lines """
+        self.assertEqual(lookup_codes(['16', '24', '-5', '1002', 'x']),
+                         {4, 1002})
+        result = color_table('LDConfig', read_colors(self.TABLE),
+                             ['16', '-5'])
+        self.assertIn('ldraw_colors_LDConfig = [\n undef,\n undef,\n'
+                      ' undef,\n undef,\n ["#B40000FF","#333333"]];\n'
+                      'ldraw_colors_LDConfig_sparse = [];', result)
+
+
+class TestUsedColors(TestCase):
+    """ tests for self-contained files with the used colors only """
+
+    def test_batch_should_include_colors_of_reused_parts(self):
+        """ test that translations reused in a batch add their colors """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            libdir = make_library(os.path.join(tmpdir, 'ldraw'))
+            with open(os.path.join(libdir, 'parts', 'tile.dat'), 'w',
+                      encoding="utf-8") as fdw:
+                fdw.write("3 0 0 0 0 1 0 0 0 0 1\n")
+            models = []
+            for name, color in [('a', 4), ('b', 16)]:
+                models.append(os.path.join(tmpdir, name + '.ldr'))
+                with open(models[-1], 'w', encoding="utf-8") as fdw:
+                    fdw.write(f"1 {color} 0 0 0 1 0 0 0 1 0 0 0 1 "
+                              "tile.dat\n")
+            converter = LDrawConverter(libdir, index_cache=False)
+            converter.set('used_colors', True)
+            converter.convert_files(
+                [(model, model + '.scad') for model in models], True)
+            results = []
+            for model in models:
+                with open(model + '.scad', encoding="utf-8") as fdr:
+                    results.append(fdr.read())
+        self.assertIn('ldraw_colors_LDConfig = [\n'
+                      ' ["#1B2A34FF","#2B4354"],\n undef,\n undef,\n'
+                      ' undef,\n ["#B40000FF","#333333"]];', results[0])
+        self.assertIn('ldraw_colors_LDConfig = [\n'
+                      ' ["#1B2A34FF","#2B4354"]];', results[1])
+        for result in results:
+            self.assertEqual(result.count('function ldraw_color('), 1)
@@ -0,0 +1,75 @@
+""" test cases for the dependency graph """
+
+from unittest import TestCase
+import os
+import json
+import tempfile
+
+from ldraw_to_scad import LDrawConverter
+from ldraw_to_scad.depgraph import DependencyGraph
+
+from .library import make_library
+
+
+class TestDependencyGraph(TestCase):
+    """ tests for queries of the dependency graph """
+    GRAPH = {'a.dat': ['B.dat', 'c.dat'], 'b.dat': ['c.dat', 'x.dat'],
+             'c.dat': [], 'd.dat': ['e.dat'], 'e.dat': ['f.dat'],
+             'f.dat': ['d.dat'], 'g.dat': ['g.dat', 'a.dat']}
+
+    def test_it_should_report_missing_files_and_cycles(self):
+        """ test missing files and circular references """
+        graph = DependencyGraph(self.GRAPH)
+        self.assertEqual(graph.missing(), {'x.dat': ['b.dat']})
+        self.assertEqual(graph.cycles(), [['d.dat', 'e.dat', 'f.dat'],
+                                          ['g.dat']])
+        with self.assertRaises(ValueError):
+            graph.order()
+
+    def test_it_should_query_dependencies_and_dependents(self):
+        """ test direct and transitive queries in both directions """
+        graph = DependencyGraph(self.GRAPH)
+        self.assertEqual(graph.dependencies('A.DAT'), ['b.dat', 'c.dat'])
+        self.assertEqual(graph.dependencies('a.dat', transitive=True),
+                         ['b.dat', 'c.dat', 'x.dat'])
+        self.assertEqual(graph.dependents('c.dat'), ['a.dat', 'b.dat'])
+        self.assertEqual(graph.dependents('c.dat', transitive=True),
+                         ['a.dat', 'b.dat', 'g.dat'])
+
+    def test_it_should_order_dependencies_first(self):
+        """ test the topological order """
+        graph = DependencyGraph({name: deps for name, deps in
+                                 self.GRAPH.items() if name < 'd'})
+        self.assertEqual(graph.order(), ['c.dat', 'b.dat', 'a.dat'])
+
+
+class TestLibraryGraph(TestCase):
+    """ tests for the dependency graph of a library """
+    def test_it_should_include_library_and_models(self):
+        """ test building and exporting the graph of the test library """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            converter = LDrawConverter(
+                make_library(os.path.join(tmpdir, 'ldraw')),
+                index_cache=False)
+            model = os.path.join(tmpdir, 'model.ldr')
+            with open(model, 'w', encoding="utf-8") as fdw:
+                fdw.write("0 FILE model.ldr\n"
+                          "1 4 0 0 0 1 0 0 0 1 0 0 0 1 sub.ldr\n"
+                          "0 FILE sub.ldr\n"
+                          "1 4 0 0 0 1 0 0 0 1 0 0 0 1 3001.dat\n"
+                          "1 4 0 0 0 1 0 0 0 1 0 0 0 1 3002.dat\n")
+            graph = converter.dependency_graph([model])
+            graph.save(os.path.join(tmpdir, 'graph.json'))
+            with open(os.path.join(tmpdir, 'graph.json'),
+                      encoding="utf-8") as fdr:
+                exported = json.load(fdr)
+        model = model.lower()
+        self.assertEqual(graph.order(), [
+            '4-4cyli.dat', '48\\4-4cyli.dat', '8\\4-4cyli.dat',
+            's\\3001s01.dat', 'stud.dat', '3001.dat', model])
+        self.assertEqual(graph.dependents('4-4cyli.dat', transitive=True),
+                         sorted(['3001.dat', model, 'stud.dat']))
+        self.assertEqual(exported['missing'], {'3002.dat': [model]})
+        self.assertEqual(exported['files']['3001.dat'],
+                         ['s\\3001s01.dat', 'stud.dat'])
+        self.assertEqual(exported['cycles'], [])
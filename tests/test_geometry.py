@@ -0,0 +1,349 @@
+""" test cases for the geometry output modes of ldraw_to_scad """
+
+from unittest import TestCase, skipIf
+import os
+import tempfile
+import mock
+
+from ldraw_to_scad import LDrawConverter, geometry, arraygeometry, \
+    partstore, mesh
+
+from .library import make_library
+
+
+class TestFlatten(TestCase):
+    """ tests for resolving the reference tree in python """
+    MODEL = [
+        "1 4 10 0 0 -1 0 0 0 1 0 0 0 1 tri.dat\n",
+        "0 STEP\n",
+        "0 BFC INVERTNEXT\n",
+        "1 16 0 0 0 1 0 0 0 1 0 0 0 1 tri.dat\n",
+    ]
+    TRI = ("0 BFC CERTIFY CCW\n"
+           "3 16 0 0 0 1 0 0 0 1 0\n"
+           "2 24 0 0 0 1 0 0\n")
+
+    def make_converter(self, tmpdir):
+        """ set up a converter on a library containing tri.dat """
+        libdir = make_library(os.path.join(tmpdir, 'ldraw'))
+        with open(os.path.join(libdir, 'parts', 'tri.dat'), 'w',
+                  encoding="utf-8") as fdw:
+            fdw.write(self.TRI)
+        return LDrawConverter(libdir, index_cache=False)
+
+    def test_it_should_apply_winding_colors_and_steps(self):
+        """ test flattening against the rules of lib.scad """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            converter = self.make_converter(tmpdir)
+            flat = converter.flattener().flatten(geometry.parse(
+                self.MODEL, LDrawConverter.make_function_name))
+        self.assertEqual(flat, [
+            (True, ((10, 0, 0), (9, 0, 0), (10, 1, 0)), 4, 0),
+            (False, ((10, 0, 0), (9, 0, 0)), -5, 0),
+            (True, ((0, 0, 0), (1, 0, 0), (0, 1, 0)), 16, 1),
+            (False, ((0, 0, 0), (1, 0, 0)), 24, 1),
+        ])
+
+    def test_it_should_write_flattened_file(self):
+        """ test the file written in flatten mode """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            converter = self.make_converter(tmpdir)
+            model = os.path.join(tmpdir, 'model.ldr')
+            with open(model, 'w', encoding="utf-8") as fdw:
+                fdw.writelines(self.MODEL)
+            converter.convert_file(model, model + '.scad', flatten=True)
+            with open(model + '.scad', encoding="utf-8") as fdr:
+                output = fdr.read().split('\n')
+        self.assertEqual(output, [
+            "use <LDraw/lib.scad>",
+            "function ldraw_lib____main__() = [",
+            "  [true,[[10,0,0],[9,0,0],[10,1,0]],4,0],",
+            "  [false,[[10,0,0],[9,0,0]],-5,0],",
+            "  [true,[[0,0,0],[1,0,0],[0,1,0]],16,1],",
+            "  [false,[[0,0,0],[1,0,0]],24,1],",
+            "];",
+            ("module ldraw_lib____main__(step=0, col=false, unit=2/5, "
+             "alt=false, line=0.2, solid=!$preview)"),
+            ("    makepoly(ldraw_lib____main__(), step=step, col=col, "
+             "unit=unit, alt=alt, line=line, solid=solid, flat=true);"),
+            "ldraw_lib____main__(line=0.2);"
+        ])
+
+    def test_it_should_reject_circular_references(self):
+        """ test that a subfile referencing itself is reported """
+        lines = ["0 FILE a.ldr\n",
+                 "1 16 0 0 0 1 0 0 0 1 0 0 0 1 b.ldr\n",
+                 "0 FILE b.ldr\n",
+                 "1 16 0 0 0 1 0 0 0 1 0 0 0 1 b.ldr\n"]
+        flattener = geometry.Flattener(None, LDrawConverter.make_function_name)
+        with self.assertRaises(ValueError):
+            flattener.flatten(geometry.parse(
+                lines, LDrawConverter.make_function_name))
+
+
+@skipIf(arraygeometry.numpy is None, 'NumPy not available')
+class TestArrayFlatten(TestCase):
+    """ tests for the vectorized flattener """
+    MODEL = [
+        "0 BFC CERTIFY CW\n",
+        "1 4 10 0 0 -1 0 0 0 1 0 0 0 1 3001.dat\n",
+        "3 0x2FF0000 0 0 0 1 0 0 0 1 0\n",
+        "0 STEP\n",
+        "0 BFC INVERTNEXT\n",
+        "1 24 0 -24 0 0 0 1 0 1 0 1 0 0 3001.dat\n",
+        "1 16 0 -48 0 0.5 0 0 0 2 0 0 0 1 stud.dat\n",
+        "0 STEP\n",
+        "1 2 0 0 0 1 0 0 0 1 0 0 0 1 stud.dat\n",
+    ]
+
+    def test_it_should_match_the_python_flattener(self):
+        """ test that both engines produce the same geometry """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            converter = LDrawConverter(
+                make_library(os.path.join(tmpdir, 'ldraw')),
+                index_cache=False)
+            sections = geometry.parse(self.MODEL,
+                                      LDrawConverter.make_function_name)
+            expected = geometry.Flattener(
+                converter.load_part,
+                LDrawConverter.make_function_name).flatten(sections)
+            result = arraygeometry.ArrayFlattener(
+                converter.load_part,
+                LDrawConverter.make_function_name).flatten(sections)
+        self.assertEqual(len(result), len(expected))
+        for (face, points, color, step), element in zip(result, expected):
+            self.assertEqual((face, len(points), color, step),
+                             (element[0], len(element[1]), element[2],
+                              element[3]))
+            for point, other in zip(points, element[1]):
+                for value, other_value in zip(point, other):
+                    self.assertAlmostEqual(value, other_value)
+
+
+class TestPartStore(TestCase):
+    """ tests for the binary part store """
+    def test_it_should_round_trip_parsed_files(self):
+        """ test that stored sections equal the parsed sections """
+        lines = ["0 FILE main.ldr\n",
+                 "0 BFC INVERTNEXT\n",
+                 "1 0x2FF0000 1 2 3 1 0 0 0 1 0 0 0 1 sub.ldr\n",
+                 "0 STEP\n",
+                 "0 FILE sub.ldr\n",
+                 "5 24 0 0 0 1 1 1 0 1 0 1 0 0\n",
+                 "4 16 0 0 0 1 0 0 1 1 0 0 1 0\n"]
+        sections = geometry.parse(lines, LDrawConverter.make_function_name)
+        writer = partstore.StoreWriter()
+        writer.add('model.ldr', sections, 5, 6)
+        writer.add('empty.dat', {geometry.MAIN: []})
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'parts.store')
+            writer.write(filename)
+            store = partstore.PartStore(filename)
+            loaded = store.load('model.ldr')
+            self.assertEqual(loaded, sections)
+            self.assertIs(loaded[geometry.MAIN], loaded['ldraw_lib__main'])
+            self.assertEqual(store.signature('model.ldr'), (5, 6))
+            self.assertEqual(store.load('empty.dat'), {geometry.MAIN: []})
+            store.close()
+
+    def test_flattening_should_use_the_store_if_current(self):
+        """ test flattening from the store and fallback to the text """
+        model = geometry.parse(TestFlatten.MODEL,
+                               LDrawConverter.make_function_name)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            libdir = make_library(os.path.join(tmpdir, 'ldraw'))
+            with open(os.path.join(libdir, 'parts', 'tri.dat'), 'w',
+                      encoding="utf-8") as fdw:
+                fdw.write(TestFlatten.TRI)
+            converter = LDrawConverter(libdir, index_cache=False)
+            expected = converter.flattener().flatten(model)
+            filename = os.path.join(tmpdir, 'parts.store')
+            converter.compile_store(filename)
+            converter.open_store(filename)
+            with mock.patch.object(converter.store, 'load',
+                                   wraps=converter.store.load) as load:
+                self.assertEqual(
+                    converter.flattener().flatten(model), expected)
+                self.assertEqual(load.call_count, 1)
+                with open(os.path.join(tmpdir, 'ldraw', 'parts', 'tri.dat'),
+                          'a', encoding="utf-8") as fdw:
+                    fdw.write('2 4 0 0 0 0 0 1\n')
+                flat = converter.flattener().flatten(model)
+                self.assertEqual(load.call_count, 1)
+            converter.store.close()
+        self.assertEqual(len(flat), len(expected) + 2)
+
+
+class TestInstances(TestCase):
+    """ tests for writing shared library parts once """
+    MODEL = [
+        "0 FILE wall.ldr\n",
+        "1 4 0 0 0 1 0 0 0 1 0 0 0 1 tri.dat\n",
+        "0 STEP\n",
+        "1 16 0 -24 0 1 0 0 0 1 0 0 0 1 row.ldr\n",
+        "0 FILE row.ldr\n",
+        "0 BFC INVERTNEXT\n",
+        "1 24 5 0 0 -1 0 0 0 1 0 0 0 1 tri.dat\n",
+        "2 16 0 0 0 1 1 1\n",
+    ]
+
+    def test_instances_should_place_to_the_flattened_geometry(self):
+        """ test that placed instances equal flattening """
+        sections = geometry.parse(self.MODEL,
+                                  LDrawConverter.make_function_name)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            libdir = make_library(os.path.join(tmpdir, 'ldraw'))
+            with open(os.path.join(libdir, 'parts', 'tri.dat'), 'w',
+                      encoding="utf-8") as fdw:
+                fdw.write(TestFlatten.TRI)
+            flattener = LDrawConverter(
+                libdir, index_cache=False).flattener()
+            loose, instances = flattener.instances(sections)
+            placed = list(loose)
+            for name, matrix, color, invert, step in instances:
+                placed.extend(geometry.place(
+                    matrix, flattener.flatten_part(name), color, invert,
+                    step))
+            expected = flattener.flatten(sections)
+        self.assertEqual([(name, color, invert, step)
+                          for name, _, color, invert, step in instances],
+                         [('tri.dat', 4, False, 0),
+                          ('tri.dat', 24, True, 1)])
+        self.assertEqual(sorted(placed), sorted(expected))
+
+    def test_output_should_not_grow_with_part_geometry(self):
+        """ test that each part and color is written only once """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            libdir = make_library(os.path.join(tmpdir, 'ldraw'))
+            converter = LDrawConverter(libdir, index_cache=False)
+            outputs = []
+            for count in [2, 20]:
+                model = os.path.join(tmpdir, f'wall{count}.ldr')
+                with open(model, 'w', encoding="utf-8") as fdw:
+                    fdw.writelines(
+                        f'1 4 {i * 40} 0 0 1 0 0 0 1 0 0 0 1 3001.dat\n'
+                        for i in range(count))
+                converter.convert_file(model, model + '.scad', True,
+                                       instanced=True)
+                with open(model + '.scad', encoding="utf-8") as fdr:
+                    outputs.append(fdr.read().split('\n'))
+        self.assertEqual(len(outputs[1]) - len(outputs[0]), 18)
+        for output in outputs:
+            self.assertEqual(
+                output.count('function ldraw_lib__3001() = ['), 1)
+            self.assertEqual(
+                len([line for line in output
+                     if line.startswith('module ldraw_lib__3001_c4(')]), 1)
+        self.assertIn(
+            '    instance([[1,0,0,760],[0,1,0,0],[0,0,1,0]], at=0, '
+            'step=step, unit=unit) ldraw_lib__3001_c4(col=col, unit=unit, '
+            'alt=alt, line=line, solid=solid);', outputs[1])
+
+
+class TestMesh(TestCase):
+    """ tests for assembling polyhedra in python """
+    FLAT = [
+        (True, ((0, 0, 0), (1, 0, 0), (0, 1, 0)), 4, 0),
+        (False, ((0, 0, 0), (1, 0, 0)), 24, 0),
+        (True, ((1, 0, 0), (1, 1, 0), (0, 1.001, 0)), 4, 0),
+        (True, ((0, 0, 0), (0, 0, 0.0005), (0, 1, 0)), 4, 0),
+        (True, ((0, 0, 0), (1, 0, 0), (0, 0, 1)), 1, 1),
+    ]
+
+    def test_it_should_merge_faces_per_color_and_step(self):
+        """ test assembling without welding """
+        self.assertEqual(mesh.assemble(self.FLAT), [
+            (4, 0, [(0, 0, 0), (1, 0, 0), (0, 1, 0), (1, 0, 0), (1, 1, 0),
+                    (0, 1.001, 0), (0, 0, 0), (0, 0, 0.0005), (0, 1, 0)],
+             [[0, 1, 2], [3, 4, 5], [6, 7, 8]]),
+            (1, 1, [(0, 0, 0), (1, 0, 0), (0, 0, 1)], [[0, 1, 2]]),
+        ])
+
+    def test_it_should_weld_close_points(self):
+        """ test welding with a tolerance, dropping degenerate faces """
+        self.assertEqual(mesh.assemble(self.FLAT, 0.01), [
+            (4, 0, [(0, 0, 0), (1, 0, 0), (0, 1, 0), (1, 1, 0)],
+             [[0, 1, 2], [1, 3, 2]]),
+            (1, 1, [(0, 0, 0), (1, 0, 0), (0, 0, 1)], [[0, 1, 2]]),
+        ])
+
+    def test_it_should_write_meshes(self):
+        """ test the file written in flatten mode with meshes """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            libdir = make_library(os.path.join(tmpdir, 'ldraw'))
+            converter = LDrawConverter(libdir, index_cache=False)
+            converter.set('mesh', True)
+            converter.set('weld', 0)
+            model = os.path.join(tmpdir, 'model.ldr')
+            with open(model, 'w', encoding="utf-8") as fdw:
+                fdw.write("4 4 0 0 0 1 0 0 1 1 0 0 1 0\n"
+                          "3 4 0 0 0 1 1 0 1 0 0\n")
+            converter.convert_file(model, model + '.scad', flatten=True)
+            with open(model + '.scad', encoding="utf-8") as fdr:
+                output = fdr.read().split('\n')
+        self.assertEqual(output[5:8], [
+            "function ldraw_lib____main___mesh() = [",
+            "  [4,0,[[0,1,0],[1,1,0],[1,0,0],[0,0,0]],[[0,1,2,3],[2,1,3]]],",
+            "];"])
+        self.assertEqual(output[9], (
+            "    makepoly(ldraw_lib____main__(), step=step, col=col, "
+            "unit=unit, alt=alt, line=line, solid=solid, flat=true, "
+            "mesh=ldraw_lib____main___mesh());"))
+
+
+class TestBounds(TestCase):
+    """ tests for precomputed bounds """
+    def test_it_should_accumulate_bounds_per_step(self):
+        """ test bounds of faces added up to each step """
+        self.assertEqual(geometry.step_bounds([
+            (False, ((9, 9, 9), (-9, -9, -9)), 24, 0),
+            (True, ((0, 0, 0), (1, 2, 0), (0, 1, -3)), 16, 1),
+            (True, ((-1, 5, 1), (0, 0, 0), (0, 0, 1)), 4, 3),
+        ]), [None, ((0, 0, -3), (1, 2, 0)), ((0, 0, -3), (1, 2, 0)),
+             ((-1, 0, -3), (1, 5, 1))])
+        self.assertEqual(geometry.step_bounds([]), [None])
+
+    def test_library_should_contain_bounds_functions(self):
+        """ test the functions written when translating the library """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            libdir = make_library(os.path.join(tmpdir, 'ldraw'))
+            converter = LDrawConverter(libdir, index_cache=False)
+            converter.set('scadlibs', tmpdir)
+            converter.set('bounds', True)
+            with mock.patch.object(converter, 'load_part',
+                                   wraps=converter.load_part) as load_part:
+                converter.convert_lib()
+            with open(os.path.join(tmpdir, 'LDraw', 'p', 'stud.scad'),
+                      encoding="utf-8") as fdr:
+                output = fdr.read().split('\n')
+        # every part got flattened once for all files
+        self.assertEqual(sorted(call.args[0] for call in
+                                load_part.call_args_list),
+                         sorted(converter.index))
+        self.assertEqual(output[-3:], [
+            ("function ldraw_lib__stud_bounds(step=0, unit=2/5) = "
+             "stepbounds([[[5.5434,-4,0],[6,0,2.2962]]], step, unit);"),
+            ("function ldraw_lib__stud_center(step=0, unit=2/5) = "
+             "boxcenter(ldraw_lib__stud_bounds(step, unit));"),
+            ("function ldraw_lib__stud_size(step=0, unit=2/5) = "
+             "boxsize(ldraw_lib__stud_bounds(step, unit));")])
+
+
+class TestLevelOfDetail(TestCase):
+    """ tests for flattening at a level of detail """
+    def test_it_should_flatten_primitive_variants(self):
+        """ test that low detail flattens the low resolution primitive """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            converter = LDrawConverter(
+                make_library(os.path.join(tmpdir, 'ldraw')),
+                index_cache=False)
+            converter.set('lod', 'low')
+            converter.set('simplify', True)
+            flat = converter.flattener().flatten(converter.simplify(
+                geometry.parse(
+                    ["1 4 0 0 0 1 0 0 0 1 0 0 0 1 4-4cyli.dat\n",
+                     "5 4 0 0 0 1 0 0 0 1 0 0 0 1\n"],
+                    LDrawConverter.make_function_name)))
+        self.assertEqual(flat, [
+            (True, ((1, 0, 0), (0.7071, 0, 0.7071), (0.7071, 1, 0.7071),
+                    (1, 1, 0)), 4, 0)])
@@ -2,9 +2,12 @@
 
 from unittest import TestCase
 import os
+import tempfile
 import mock
 
-from ldraw_to_scad import LDrawConverter
+from ldraw_to_scad import LDrawConverter, partcache
+
+from .library import LIBRARY, make_library, read_tree
 
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -382,3 +385,311 @@ class TestLDrawConverter(TestCase):
             ("    ldraw_lib____main__(step=step, col=col, unit=unit, "
              "alt=alt, line=line, solid=solid);")
         ])
+
+    def test_streamed_output_should_match_process_lines(self):
+        """ test that write_lines() writes the joined process_lines() """
+        # Setup
+        mpd_filename = os.path.join(THIS_DIR, "mpd_test.dat")
+        converter = LDrawConverter()
+        with open(mpd_filename, encoding="utf-8") as fdr:
+            expected = '\n'.join(
+                converter.process_lines('__main__', '/', fdr))
+        # Test
+        with open(mpd_filename, encoding="utf-8") as fdr, \
+                tempfile.TemporaryFile('w+', encoding="utf-8") as fdw, \
+                mock.patch.object(LDrawConverter, 'SPOOL_SIZE', 16):
+            converter.write_lines('__main__', '/', fdr, fdw)
+            fdw.seek(0)
+            output = fdw.read()
+        # Assert
+        self.assertEqual(output, expected)
+
+
+class TestConvertLib(TestCase):
+    """ tests for translating a whole library """
+    def convert(self, tmpdir, name, io_threads=0, bounds=False, **kwargs):
+        """ translate the test library into tmpdir/name """
+        converter = LDrawConverter(os.path.join(tmpdir, 'ldraw'),
+                                   index_cache=False)
+        converter.set('scadlibs', os.path.join(tmpdir, name))
+        converter.set('io_threads', io_threads)
+        converter.set('bounds', bounds)
+        converter.convert_lib(**kwargs)
+        return read_tree(os.path.join(tmpdir, name))
+
+    def test_parallel_output_should_match_serial_output(self):
+        """ test that convert_lib(jobs=N) writes the same files """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            make_library(os.path.join(tmpdir, 'ldraw'))
+            serial = self.convert(tmpdir, 'serial')
+            parallel = self.convert(tmpdir, 'parallel', jobs=3)
+        self.assertIn(os.path.join('LDraw', 'parts', '3001.scad'), serial)
+        self.assertEqual(serial, parallel)
+
+    def test_pipelined_output_should_match_serial_output(self):
+        """ test that threaded reads and writes give the same files """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            make_library(os.path.join(tmpdir, 'ldraw'))
+            serial = self.convert(tmpdir, 'serial')
+            with mock.patch('os.makedirs', wraps=os.makedirs) as makedirs:
+                pipelined = self.convert(tmpdir, 'pipelined', io_threads=2)
+        self.assertEqual(serial, pipelined)
+        # every output directory gets created only once
+        created = [call.args[0] for call in makedirs.call_args_list]
+        self.assertEqual(len(created), len(set(created)))
+
+    def test_incremental_should_only_translate_changed_files(self):
+        """ test that an incremental run skips unchanged files """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            libdir = make_library(os.path.join(tmpdir, 'ldraw'))
+            self.convert(tmpdir, 'out', incremental=True)
+            outdir = os.path.join(tmpdir, 'out', 'LDraw')
+            # mark an unchanged output to detect retranslation
+            with open(os.path.join(outdir, 'p', 'stud.scad'), 'a',
+                      encoding="utf-8") as fdw:
+                fdw.write('// untouched')
+            with open(os.path.join(libdir, 'parts', '3001.dat'), 'a',
+                      encoding="utf-8") as fdw:
+                fdw.write('2 24 0 0 0 1 1 1\n')
+            os.remove(os.path.join(libdir, 'p', '8', '4-4cyli.dat'))
+            result = self.convert(tmpdir, 'out', incremental=True)
+        self.assertTrue(result[os.path.join('LDraw', 'p', 'stud.scad')]
+                        .endswith(b'// untouched'))
+        self.assertIn(b'[2,24,0,0,0,1,1,1]',
+                      result[os.path.join('LDraw', 'parts', '3001.scad')])
+        self.assertNotIn(os.path.join('LDraw', 'p', '8', '4-4cyli.scad'),
+                         result)
+
+    def test_incremental_bounds_should_follow_changed_subparts(self):
+        """ test that bounds get updated when a subpart changes """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            libdir = make_library(os.path.join(tmpdir, 'ldraw'))
+            self.convert(tmpdir, 'out', bounds=True, incremental=True)
+            with open(os.path.join(libdir, 'p', 'stud.dat'), 'a',
+                      encoding="utf-8") as fdw:
+                fdw.write('3 16 0 -500 0 1 0 0 0 0 1\n')
+            result = self.convert(tmpdir, 'out', bounds=True,
+                                  incremental=True)
+            full = self.convert(tmpdir, 'full', bounds=True)
+        part = os.path.join('LDraw', 'parts', '3001.scad')
+        self.assertIn(b'-500', result[part])
+        self.assertEqual(result[part], full[part])
+
+    def test_changed_settings_should_translate_everything(self):
+        """ test that settings affecting the output invalidate files """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            make_library(os.path.join(tmpdir, 'ldraw'))
+            self.convert(tmpdir, 'out')
+            converter = LDrawConverter(os.path.join(tmpdir, 'ldraw'),
+                                       index_cache=False)
+            converter.set('scadlibs', os.path.join(tmpdir, 'out'))
+            converter.set('commented', False)
+            converter.convert_lib(incremental=True)
+            result = read_tree(os.path.join(tmpdir, 'out'))
+        self.assertNotIn(b'// ', result[os.path.join('LDraw', 'p',
+                                                     'stud.scad')])
+
+
+def listdir_fail(path):
+    """ mock the listdir function to detect scans """
+    raise AssertionError(f'unexpected scan of {path}')
+
+
+class TestIndexCache(TestCase):
+    """ tests for the persistent index cache """
+    def test_warm_cache_should_not_scan_the_library(self):
+        """ test that a cached index is used until the library changes """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            libdir = make_library(os.path.join(tmpdir, 'ldraw'))
+            cache = os.path.join(tmpdir, 'cache', 'index.json')
+            index = LDrawConverter(libdir, index_cache=cache).index
+            with mock.patch("os.listdir", listdir_fail):
+                cached = LDrawConverter(libdir, index_cache=cache).index
+            self.assertEqual(cached, index)
+            with open(os.path.join(libdir, 'parts', '3002.dat'), 'w',
+                      encoding="utf-8") as fdw:
+                fdw.write('0 Brick 2 x 3\n')
+            updated = LDrawConverter(libdir, index_cache=cache).index
+        self.assertEqual(updated['3002.dat'], ('parts', '3002'))
+        self.assertEqual(cached['s\\3001s01.dat'],
+                         (os.path.join('parts', 's'), '3001s01'))
+
+
+class TestLazyIndex(TestCase):
+    """ tests for resolving parts on demand """
+    def test_lazy_converter_should_resolve_parts_without_scan(self):
+        """ test that lazy lookups match the full index """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            libdir = make_library(os.path.join(tmpdir, 'ldraw'))
+            index = LDrawConverter(libdir, index_cache=False).index
+            with mock.patch("os.listdir", listdir_fail):
+                converter = LDrawConverter(libdir, lazy=True,
+                                           index_cache=False)
+                for name, location in index.items():
+                    self.assertEqual(converter.find_part(name), location)
+                self.assertEqual(converter.find_part('S\\3001S01.DAT'),
+                                 (os.path.join('parts', 's'), '3001s01'))
+                with self.assertRaises(KeyError):
+                    converter.find_part('3002.dat')
+                self.assertIn('3002.dat', converter.missing)
+            converter.full_index()
+        self.assertEqual(converter.index, index)
+
+
+class TestConvertFiles(TestCase):
+    """ tests for batch conversion of several files """
+    def test_batch_should_match_single_conversions(self):
+        """ test that shared work gets reused across a batch """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            libdir = make_library(os.path.join(tmpdir, 'ldraw'))
+            models = []
+            for name in ['a', 'b']:
+                models.append(os.path.join(tmpdir, name + '.ldr'))
+                with open(models[-1], 'w', encoding="utf-8") as fdw:
+                    fdw.write(f'0 Model {name}\n'
+                              '1 4 0 0 0 1 0 0 0 1 0 0 0 1 3001.dat\n')
+            converter = LDrawConverter(libdir, index_cache=False)
+            for model in models:
+                converter.convert_file(model, model + '.single', True)
+            with mock.patch.object(converter, 'colorfile',
+                                   wraps=converter.colorfile) as colorfile, \
+                    mock.patch.object(converter, 'translate_lines',
+                                      wraps=converter.translate_lines) as proc:
+                converter.convert_files(
+                    [(model, model + '.batch') for model in models], True)
+            result = read_tree(tmpdir)
+        self.assertEqual(colorfile.call_count, 1)
+        # two main files plus the four dependencies translated once
+        self.assertEqual(proc.call_count, 6)
+        for name in ['a', 'b']:
+            self.assertEqual(result[name + '.ldr.single'],
+                             result[name + '.ldr.batch'])
+
+
+class TestPartCache(TestCase):
+    """ tests for the process-wide part cache """
+    def test_it_should_not_reread_unchanged_files(self):
+        """ test that repeated conversions hit the cache """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            libdir = make_library(os.path.join(tmpdir, 'ldraw'))
+            model = os.path.join(tmpdir, 'model.ldr')
+            with open(model, 'w', encoding="utf-8") as fdw:
+                fdw.write('1 4 0 0 0 1 0 0 0 1 0 0 0 1 3001.dat\n')
+            converter = LDrawConverter(libdir, index_cache=False)
+            converter.part_cache = partcache.PartCache()
+            converter.convert_file(model, model + '.scad', True)
+            self.assertEqual(converter.cache_stats()['misses'], 4)
+            converter.convert_file(model, model + '.scad', True)
+            self.assertEqual(converter.cache_stats()['hits'], 4)
+            with open(os.path.join(libdir, 'p', 'stud.dat'), 'a',
+                      encoding="utf-8") as fdw:
+                fdw.write('0 changed\n')
+            converter.convert_file(model, model + '.scad', True)
+        self.assertEqual(converter.cache_stats(), {
+            'hits': 7, 'misses': 5, 'evictions': 0, 'entries': 4,
+            'bytes': sum(len(LIBRARY[name]) for name in [
+                os.path.join('parts', '3001.dat'),
+                os.path.join('parts', 's', '3001s01.dat'),
+                os.path.join('p', 'stud.dat'),
+                os.path.join('p', '4-4cyli.dat')]) + len('0 changed\n')})
+
+    def test_it_should_evict_least_recently_used_files(self):
+        """ test the size bound of the cache """
+        cache = partcache.PartCache(max_bytes=100)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for name in 'abc':
+                with open(os.path.join(tmpdir, name), 'w',
+                          encoding="utf-8") as fdw:
+                    fdw.write(name * 40)
+            for name in 'abab':
+                cache.get(os.path.join(tmpdir, name), 'lines', list)
+            cache.get(os.path.join(tmpdir, 'c'), 'lines', list)
+            cache.get(os.path.join(tmpdir, 'b'), 'lines', list)
+        self.assertEqual(cache.stats(), {
+            'hits': 3, 'misses': 3, 'evictions': 1, 'entries': 2,
+            'bytes': 80})
+
+
+class TestSteps(TestCase):
+    """ tests for splitting the main model at its steps """
+    def test_it_should_write_a_module_per_step(self):
+        """ test the functions and modules of a split model """
+        lines = ["0 FILE main.ldr\n",
+                 "0 BFC CW\n",
+                 "3 4 0 0 0 1 0 0 0 1 0\n",
+                 "0 STEP\n",
+                 "2 4 0 0 0 1 0 0\n",
+                 "0 FILE sub.ldr\n",
+                 "0 STEP\n"]
+        converter = LDrawConverter(index={})
+        converter.set('commented', False)
+        converter.set('steps', True)
+        output = converter.process_lines('__main__', '/', lines)
+        parameters = 'col=col, unit=unit, alt=alt, line=line, solid=solid'
+        self.assertEqual(output, [
+            "use <LDraw/lib.scad>",
+            "function ldraw_lib____main___step0() = [",
+            '  [0,"BFC","CW"],',
+            "  [3,4,0,0,0,1,0,0,0,1,0],",
+            "];",
+            "function ldraw_lib____main___step1() = [",
+            '  [0,"BFC","CW"],',
+            "  [2,4,0,0,0,1,0,0],",
+            "];",
+            "function ldraw_lib__sub() = [",
+            '  [0,"STEP"],',
+            "];",
+            ("function ldraw_lib____main__() = concat("
+             'ldraw_lib____main___step0(), [[0,"STEP"]], '
+             "ldraw_lib____main___step1());"),
+            ("module ldraw_lib____main___step0(col=false, unit=2/5, "
+             "alt=false, line=0.2, solid=!$preview)"),
+            f"    makepoly(ldraw_lib____main___step0(), {parameters});",
+            ("module ldraw_lib____main___step1(col=false, unit=2/5, "
+             "alt=false, line=0.2, solid=!$preview)"),
+            f"    makepoly(ldraw_lib____main___step1(), {parameters});",
+            ("module ldraw_lib____main__(step=0, col=false, unit=2/5, "
+             "alt=false, line=0.2, solid=!$preview) {"),
+            ("    if(step == 0 || 0 < step) "
+             f"ldraw_lib____main___step0({parameters});"),
+            ("    if(step == 0 || 1 < step) "
+             f"ldraw_lib____main___step1({parameters});"),
+            "}",
+            "ldraw_lib____main__(line=0.2);",
+            "function ldraw_lib__main() = ldraw_lib____main__();",
+            ("module ldraw_lib__main(step=0, col=false, unit=2/5, "
+             "alt=false, line=0.2, solid=!$preview)"),
+            ("    ldraw_lib____main__(step=step, col=col, unit=unit, "
+             "alt=alt, line=line, solid=solid);"),
+        ])
+
+
+class TestLevelOfDetail(TestCase):
+    """ tests for the level of detail of translated files """
+    def test_it_should_reference_primitive_variants(self):
+        """ test rewriting of references by level of detail """
+        lines = ["1 16 0 0 0 1 0 0 0 1 0 0 0 1 4-4CYLI.DAT",
+                 "1 16 0 0 0 1 0 0 0 1 0 0 0 1 stud.dat",
+                 "1 16 0 0 0 1 0 0 0 1 0 0 0 1 3001.dat",
+                 "5 24 1 0 0 1 1 0 0.9239 0 0.3827 0.9239 0 -0.3827"]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            converter = LDrawConverter(
+                make_library(os.path.join(tmpdir, 'ldraw')),
+                index_cache=False)
+        converter.set('commented', False)
+        output = {}
+        for lod, simplify in [('low', True), ('normal', True),
+                              ('high', False)]:
+            converter.set('lod', lod)
+            converter.set('simplify', simplify)
+            output[lod] = list(converter.translate_lines(lines))
+        self.assertEqual(output['low'], [
+            "  [1,16,0,0,0,1,0,0,0,1,0,0,0,1, ldraw_lib__8__4_4cyli()],",
+            "  [1,16,0,0,0,1,0,0,0,1,0,0,0,1, ldraw_lib__stud()],",
+            "  [1,16,0,0,0,1,0,0,0,1,0,0,0,1, ldraw_lib__3001()],"])
+        self.assertEqual(output['normal'][0], (
+            "  [1,16,0,0,0,1,0,0,0,1,0,0,0,1, ldraw_lib__4_4cyli()],"))
+        self.assertEqual(len(output['normal']), 4)
+        self.assertEqual(output['high'][0], (
+            "  [1,16,0,0,0,1,0,0,0,1,0,0,0,1, ldraw_lib__48__4_4cyli()],"))
+        self.assertEqual(len(output['high']), 4)
@@ -0,0 +1,89 @@
+""" test cases for reading the library from a zip archive """
+
+from unittest import TestCase
+import os
+import zipfile
+import tempfile
+
+from ldraw_to_scad import LDrawConverter
+from ldraw_to_scad.libraryfs import DISK, ZipFiles, open_library
+
+from .library import LIBRARY, make_library, read_tree
+
+
+def make_archive(filename):
+    """ write the test library into an archive like complete.zip """
+    with zipfile.ZipFile(filename, 'w') as archive:
+        archive.writestr('ldraw/models/', '')
+        for name, content in LIBRARY.items():
+            archive.writestr('ldraw/' + name.replace(os.sep, '/'), content)
+    return filename
+
+
+class TestZipLibrary(TestCase):
+    """ tests for converting a library read from an archive """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=R1732
+        self.libdir = make_library(os.path.join(self.tmpdir.name, 'ldraw'))
+        self.archive = make_archive(
+            os.path.join(self.tmpdir.name, 'complete.zip'))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def convert(self, libdir, name, **kwargs):
+        """ translate a library into tmpdir/name """
+        os.makedirs(os.path.join(self.tmpdir.name, name))
+        converter = LDrawConverter(libdir, index_cache=False)
+        converter.set('scadlibs', os.path.join(self.tmpdir.name, name))
+        converter.convert_lib(**kwargs)
+        result = read_tree(os.path.join(self.tmpdir.name, name))
+        # the manifest records modification times of the sources
+        result.pop(os.path.join('LDraw', 'manifest.json'), None)
+        return converter, result
+
+    def test_archive_should_give_same_library(self):
+        """ test translating the archive and the extracted tree """
+        extracted, expected = self.convert(self.libdir, 'extracted')
+        archived, result = self.convert(self.archive, 'archived')
+        self.assertIsInstance(archived.files, ZipFiles)
+        self.assertIs(extracted.files, DISK)
+        self.assertEqual(archived.index, extracted.index)
+        self.assertEqual(result, expected)
+        self.assertEqual(self.convert(self.archive, 'archived-single',
+                                      self_contained=True)[1],
+                         self.convert(self.libdir, 'extracted-single',
+                                      self_contained=True)[1])
+
+    def test_archive_should_be_opened_once(self):
+        """ test sharing the archive and reading members on demand """
+        files = open_library(self.archive)
+        self.assertIs(open_library(self.archive), files)
+        self.assertEqual(files.prefix, 'ldraw/')
+        self.assertEqual(sorted(files.listdir(
+            os.path.join(self.archive, 'p', '48'))), ['4-4cyli.dat'])
+        self.assertTrue(files.isfile(
+            os.path.join(self.archive, 'parts', 's', '3001s01.dat')))
+        self.assertFalse(files.isfile(
+            os.path.join(self.archive, 'parts', '3002.dat')))
+        with self.assertRaises(FileNotFoundError):
+            files.stat(os.path.join(self.archive, 'parts', '3002.dat'))
+        with files.open(os.path.join(self.archive, 'p', 'stud.dat')) as fdr:
+            self.assertEqual(fdr.read(),
+                             LIBRARY[os.path.join('p', 'stud.dat')])
+
+    def test_archive_should_support_lazy_lookup_and_flattening(self):
+        """ test on-demand lookup and flattened output from an archive """
+        model = os.path.join(self.tmpdir.name, 'model.ldr')
+        with open(model, 'w', encoding="utf-8") as fdw:
+            fdw.write("1 4 0 0 0 1 0 0 0 1 0 0 0 1 3001.dat\n")
+        results = []
+        for libdir in [self.libdir, self.archive]:
+            converter = LDrawConverter(libdir, lazy=True,
+                                       index_cache=False)
+            converter.convert_file(model, model + '.scad', flatten=True)
+            with open(model + '.scad', encoding="utf-8") as fdr:
+                results.append(fdr.read())
+            self.assertIn('s\\3001s01.dat', converter.index)
+        self.assertEqual(results[0], results[1])
@@ -0,0 +1,106 @@
+""" test cases for exporting meshes without OpenSCAD """
+
+from unittest import TestCase, skipIf
+import os
+import struct
+import zipfile
+import tempfile
+
+from ldraw_to_scad import LDrawConverter, meshexport, arraygeometry
+
+from .library import make_library
+
+
+class TestMeshExport(TestCase):
+    """ tests for writing binary STL and 3MF """
+    FLAT = [
+        (True, ((10, 0, 0), (9, 0, 0), (10, 1, 0)), 4, 0),
+        (False, ((10, 0, 0), (9, 0, 0)), -5, 0),
+        (True, ((0, 0, 0), (0, 0, 1), (1, 0, 1), (1, 0, 0)), 16, 1),
+    ]
+    MODEL = ("4 4 0 0 0 1 0 0 1 1 0 0 1 0\n"
+             "3 4 0 0 0 1 1 0 1 0 0\n"
+             "2 24 0 0 0 1 0 0\n")
+
+    @staticmethod
+    def make_converter(tmpdir):
+        """ set up a converter on the test library """
+        return LDrawConverter(make_library(os.path.join(tmpdir, 'ldraw')),
+                              index_cache=False)
+
+    def test_it_should_turn_faces_counterclockwise(self):
+        """ test the transformation of unitmatrix() and the winding """
+        result = list(meshexport.triangles(self.FLAT))
+        self.assertEqual(len(result), 3)
+        self.assertEqual(result[0], (4, ((4.0, 0.0, -0.4), (3.6, 0.0, -0.0),
+                                         (4.0, 0.0, -0.0))))
+        self.assertEqual(meshexport.normal(result[0][1]), (0.0, 1.0, 0.0))
+        self.assertEqual([color for color, _ in result], [4, 16, 16])
+
+    def test_it_should_write_binary_stl(self):
+        """ test the header and triangles of an STL file """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            stlfile = os.path.join(tmpdir, 'model.stl')
+            self.assertEqual(meshexport.write_stl(stlfile, self.FLAT), 3)
+            with open(stlfile, 'rb') as fdr:
+                data = fdr.read()
+        self.assertEqual(len(data), 84 + 3 * 50)
+        self.assertEqual(struct.unpack('<I', data[80:84]), (3,))
+        first = struct.unpack('<12fH', data[84:134])
+        self.assertEqual(first[:3], (0.0, 1.0, 0.0))
+
+    @skipIf(arraygeometry.numpy is None, 'NumPy is not installed')
+    def test_arrays_should_give_the_same_stl(self):
+        """ test exporting flattened arrays against elements """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files = [os.path.join(tmpdir, name) for name in ['a', 'b']]
+            meshexport.write_stl(files[0], self.FLAT)
+            meshexport.write_stl(files[1],
+                                 arraygeometry.make_geometry(self.FLAT))
+            data = []
+            for name in files:
+                with open(name, 'rb') as fdr:
+                    data.append(fdr.read())
+        self.assertEqual(data[0], data[1])
+
+    def test_it_should_export_3mf_with_materials(self):
+        """ test exporting a model as 3MF through the converter """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            converter = self.make_converter(tmpdir)
+            model = os.path.join(tmpdir, 'model.ldr')
+            with open(model, 'w', encoding="utf-8") as fdw:
+                fdw.write(self.MODEL)
+            self.assertEqual(
+                converter.export_mesh(model, model + '.3mf'), 3)
+            with zipfile.ZipFile(model + '.3mf') as archive:
+                names = archive.namelist()
+                content = archive.read('3D/3dmodel.model').decode('utf-8')
+        self.assertEqual(names, ['[Content_Types].xml', '_rels/.rels',
+                                 '3D/3dmodel.model'])
+        self.assertIn('<base name="4" displaycolor="#B40000FF"/>', content)
+        self.assertIn('<object id="2" type="model" pid="1" pindex="0">',
+                      content)
+        self.assertEqual(content.count('<vertex '), 4)
+        self.assertEqual(content.count('<triangle '), 3)
+        self.assertIn('<item objectid="2"/>', content)
+
+    def test_it_should_export_3mf_without_materials(self):
+        """ test exporting a part in the inherited color only """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            converter = self.make_converter(tmpdir)
+            model = os.path.join(tmpdir, 'model.ldr')
+            with open(model, 'w', encoding="utf-8") as fdw:
+                fdw.write("1 16 0 0 0 1 0 0 0 1 0 0 0 1 3001.dat\n")
+            converter.export_mesh(model, model + '.3mf')
+            with zipfile.ZipFile(model + '.3mf') as archive:
+                content = archive.read('3D/3dmodel.model').decode('utf-8')
+        self.assertNotIn('basematerials', content)
+        self.assertIn('<object id="2" type="model">', content)
+        self.assertNotIn('pid=', content)
+
+    def test_it_should_reject_unknown_formats(self):
+        """ test the format check of the converter """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            converter = self.make_converter(tmpdir)
+            with self.assertRaises(ValueError):
+                converter.export_mesh('model.ldr', 'model.obj')
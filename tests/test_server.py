@@ -0,0 +1,153 @@
+""" test cases for the conversion service """
+
+from unittest import TestCase
+import os
+import json
+import socket
+import tempfile
+import threading
+import http.client
+import concurrent.futures
+import mock
+
+from ldraw_to_scad import LDrawConverter
+from ldraw_to_scad.server import ConversionService, ConversionServer, \
+    UnixConversionServer, parse_query
+
+from .library import make_library
+
+
+MODELS = [f"0 Model {color}\n"
+          f"1 {color} 0 0 0 1 0 0 0 1 0 0 0 1 3001.dat\n"
+          "1 16 0 24 0 1 0 0 0 1 0 0 0 1 stud.dat\n"
+          for color in [0, 4, 16, 0, 4, 16]]
+
+
+class TestConversionService(TestCase):
+    """ tests for conversions with a warm converter """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=R1732
+        self.libdir = make_library(os.path.join(self.tmpdir.name, 'ldraw'))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def expected(self, model, **settings):
+        """ convert a model with a converter of its own """
+        ldrfile = os.path.join(self.tmpdir.name, 'expected.ldr')
+        with open(ldrfile, 'w', encoding="utf-8") as fdw:
+            fdw.write(model)
+        converter = LDrawConverter(self.libdir, index_cache=False)
+        converter.settings.update(settings)
+        converter.convert_file(ldrfile, ldrfile + '.scad', True)
+        with open(ldrfile + '.scad', encoding="utf-8") as fdr:
+            return fdr.read()
+
+    def test_concurrent_conversions_should_match_single_ones(self):
+        """ test converting models in several threads at once """
+        service = ConversionService(self.libdir, index_cache=False)
+        with concurrent.futures.ThreadPoolExecutor(4) as pool:
+            results = list(pool.map(service.convert, MODELS))
+        lined = service.convert(MODELS[0], line=0.5)
+        self.assertEqual(results, [self.expected(model) for model in MODELS])
+        self.assertEqual(lined, self.expected(MODELS[0], line=0.5))
+        self.assertEqual(service.status()['conversions'], len(MODELS) + 1)
+        self.assertEqual(len(service.translated), 2)
+
+    def test_changed_library_files_should_be_translated_again(self):
+        """ test that translations of edited parts are not reused """
+        service = ConversionService(self.libdir, index_cache=False)
+        service.convert(MODELS[0])
+        stud = os.path.join(self.libdir, 'p', 'stud.dat')
+        with open(stud, 'a', encoding="utf-8") as fdw:
+            fdw.write('2 24 0 0 0 1 1 1\n')
+        self.assertEqual(service.convert(MODELS[0]),
+                         self.expected(MODELS[0]))
+
+    def test_it_should_write_output_and_reject_bad_requests(self):
+        """ test writing to a file and invalid parameters """
+        service = ConversionService(self.libdir, index_cache=False,
+                                    output_root=self.tmpdir.name)
+        self.assertIsNone(service.convert(MODELS[1], output='out.scad',
+                                          self_contained=False))
+        with open(os.path.join(self.tmpdir.name, 'out.scad'),
+                  encoding="utf-8") as fdr:
+            self.assertIn('use <LDraw/parts/3001.scad>', fdr.read())
+        with self.assertRaises(ValueError):
+            service.convert(MODELS[1], library_root='/')
+        for output in [os.path.join(self.tmpdir.name, 'out.scad'),
+                       os.path.join('..', 'out.scad'), '']:
+            with self.assertRaises(ValueError):
+                service.convert(MODELS[1], output=output)
+        with self.assertRaises(ValueError):
+            ConversionService(self.libdir, index_cache=False).convert(
+                MODELS[1], output='out.scad')
+        with self.assertRaises(ValueError):
+            parse_query('flatten=maybe')
+        self.assertEqual(parse_query('line=0.5&steps=1&flatten=off'),
+                         {'line': 0.5, 'steps': True, 'flatten': False})
+        self.assertEqual(service.status()['errors'], 4)
+
+    def test_http_server_should_convert_models(self):
+        """ test a conversion and the status over HTTP """
+        service = ConversionService(self.libdir, index_cache=False)
+        with ConversionServer(service, ('127.0.0.1', 0)) as server:
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            try:
+                connection = http.client.HTTPConnection(
+                    '127.0.0.1', server.server_port)
+                connection.request('POST', '/convert?line=0.2', MODELS[1])
+                response = connection.getresponse()
+                text = response.read().decode('utf-8')
+                connection.request('POST', '/convert', '1 4 0 0 0 1 0 0 0 '
+                                   '1 0 0 0 1 9999.dat\n')
+                missing = connection.getresponse()
+                error = json.loads(missing.read())
+                with mock.patch.object(service, 'convert',
+                                       side_effect=RuntimeError('broken')):
+                    connection.request('POST', '/convert', MODELS[1])
+                    failed = connection.getresponse()
+                    failure = json.loads(failed.read())
+                connection.request('GET', '/status')
+                status = json.loads(connection.getresponse().read())
+                connection.close()
+            finally:
+                server.shutdown()
+                thread.join()
+        self.assertEqual(response.status, 200)
+        self.assertEqual(text, self.expected(MODELS[1]))
+        self.assertEqual(missing.status, 400)
+        self.assertIn('9999.dat', error['error'])
+        self.assertEqual(failed.status, 500)
+        self.assertEqual(failure['error'], 'RuntimeError: broken')
+        self.assertEqual(status['conversions'], 2)
+
+    def test_unix_socket_server_should_convert_models(self):
+        """ test a conversion over a Unix socket """
+        service = ConversionService(self.libdir, index_cache=False)
+        path = os.path.join(self.tmpdir.name, 'server.sock')
+        with UnixConversionServer(service, path) as server:
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            try:
+                with socket.socket(socket.AF_UNIX) as client:
+                    client.connect(path)
+                    body = MODELS[2].encode('utf-8')
+                    client.sendall(b'POST /convert HTTP/1.0\r\n'
+                                   b'Content-Length: %d\r\n\r\n' % len(body)
+                                   + body)
+                    response = b''
+                    while True:
+                        data = client.recv(65536)
+                        if not data:
+                            break
+                        response += data
+            finally:
+                server.shutdown()
+                thread.join()
+        head, text = response.decode('utf-8').split('\r\n\r\n', 1)
+        self.assertTrue(head.startswith('HTTP/1.0 200'))
+        self.assertEqual(text, self.expected(MODELS[2]))
+        self.assertFalse(os.path.exists(path))
@@ -0,0 +1,85 @@
+""" test cases for the conversion statistics """
+
+from unittest import TestCase, mock
+import os
+import json
+import tempfile
+
+from ldraw_to_scad import LDrawConverter
+from ldraw_to_scad.stats import ConversionStats
+
+from .library import LIBRARY, make_library, read_tree
+
+
+class TestConversionStats(TestCase):
+    """ tests for timers and counters """
+
+    def test_nested_timers_should_be_exclusive(self):
+        """ test that an inner phase pauses the outer one """
+        stats = ConversionStats()
+        with mock.patch('time.perf_counter', side_effect=[0, 1, 3, 6]):
+            with stats.timer('translate'):
+                with stats.timer('read'):
+                    pass
+        self.assertEqual(stats.times['translate'], 4)
+        self.assertEqual(stats.times['read'], 2)
+
+    def test_it_should_merge_statistics(self):
+        """ test adding the statistics of a worker """
+        stats = ConversionStats(slowest=2)
+        stats.file_done('a.dat', 1.0)
+        worker = ConversionStats()
+        worker.file_done('b.dat', 3.0)
+        worker.file_done('c.dat', 2.0)
+        list(worker.count_lines(['1 16 0 0 0 1 0 0 0 1 0 0 0 1 a.dat',
+                                 '0 comment', '', '3 16 0 0 0 1 0 0 0 1 0']))
+        stats.merge(json.loads(json.dumps(worker.to_dict())))
+        data = stats.to_dict()
+        self.assertEqual(data['counters']['files'], 3)
+        self.assertEqual(data['lines'],
+                         {'0': 1, '1': 1, '2': 0, '3': 1, '4': 0, '5': 0})
+        self.assertEqual([entry['file'] for entry in data['slowest']],
+                         ['b.dat', 'c.dat'])
+
+
+class TestConverterStats(TestCase):
+    """ tests for statistics collected by the converter """
+
+    def test_it_should_count_library_conversion(self):
+        """ test the counters of translating the library """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            libdir = make_library(os.path.join(tmpdir, 'ldraw'))
+            converter = LDrawConverter(libdir, index_cache=False,
+                                       stats=True)
+            converter.set('scadlibs', tmpdir)
+            converter.convert_lib()
+            output = read_tree(os.path.join(tmpdir, 'LDraw'))
+            converter.stats.save(os.path.join(tmpdir, 'profile.json'))
+            with open(os.path.join(tmpdir, 'profile.json'),
+                      encoding="utf-8") as fdr:
+                data = json.load(fdr)
+        self.assertEqual(data['counters']['files'], len(LIBRARY) - 2)
+        self.assertEqual(data['counters']['source_bytes'], sum(
+            len(content) for name, content in LIBRARY.items()
+            if name.endswith('.dat')))
+        # lib.scad, colors.scad and the manifest are not counted
+        self.assertEqual(data['counters']['bytes_written'], sum(
+            len(content) for name, content in output.items()
+            if name.endswith('.scad') and
+            name not in ['lib.scad', 'colors.scad']))
+        self.assertEqual(data['lines'],
+                         {'0': 7, '1': 3, '2': 1, '3': 0, '4': 4, '5': 1})
+        self.assertEqual(len(data['slowest']), len(LIBRARY) - 2)
+        self.assertGreater(data['times']['translate'], 0)
+        self.assertGreater(data['times']['colors'], 0)
+        self.assertIn('Slowest files:', converter.stats.report())
+
+    def test_it_should_be_disabled_by_default(self):
+        """ test that no statistics get collected unless enabled """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            converter = LDrawConverter(
+                make_library(os.path.join(tmpdir, 'ldraw')),
+                index_cache=False)
+            converter.set('scadlibs', tmpdir)
+            converter.convert_lib()
+        self.assertIsNone(converter.stats)